@@ -0,0 +1,310 @@
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+
+# бенчмарк гоняется без экрана
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from sqlalchemy import event
+
+from bulk_io import BulkImporter
+from models import GameNews, init_db, get_session, get_news_page, search_news, find_user
+from services import NewsService
+from stats import StatsService
+
+DEFAULT_SCALES = [1000, 100000, 1000000]
+DEFAULT_SEED = 42
+CATEGORIES = ["Обновления", "Релизы", "Технические новости"]
+GAMES = [None, "CS2", "DOTA2", "Deadlock"]
+WORDS = [
+    "обновление", "патч", "герой", "карта", "баланс", "сервер", "турнир", "релиз", "исправление",
+    "оружие", "режим", "сезон", "рейтинг", "матч", "команда", "предмет", "событие", "игрок",
+]
+# пропорции данных на одну новость
+USERS_PER_NEWS = 1 / 50
+IMAGES_PER_NEWS = 0.5
+VIEWS_PER_NEWS = 3
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+# записи в формате bulk_io: пользователи, новости за два года, картинки и просмотры
+def generate_records(scale, seed=DEFAULT_SEED):
+    rng = random.Random(seed)
+    users = max(10, int(scale * USERS_PER_NEWS))
+
+    yield {'type': 'user', 'username': 'admin', 'password': 'admin', 'role': 'Admin'}
+    for number in range(1, users):
+        yield {'type': 'user', 'username': f'user{number}', 'password': 'password', 'role': 'Пользователь'}
+
+    start = datetime(2024, 1, 1)
+    span_seconds = 2 * 365 * 24 * 3600
+    for news_id in range(1, scale + 1):
+        yield {
+            'type': 'news',
+            'id': news_id,
+            'title': sentence(rng, rng.randint(3, 8)),
+            'content': sentence(rng, rng.randint(40, 400)),
+            'category': rng.choice(CATEGORIES),
+            'game': rng.choice(GAMES),
+            'date_posted': (start + timedelta(seconds=rng.randrange(span_seconds))).isoformat(),
+            'author': 'admin',
+        }
+
+    for number in range(int(scale * IMAGES_PER_NEWS)):
+        yield {'type': 'image', 'news_id': rng.randint(1, scale), 'image_path': f'media/bench/{number}.png'}
+
+    for _ in range(int(scale * VIEWS_PER_NEWS)):
+        user = rng.randrange(users)
+        yield {
+            'type': 'view',
+            'news_id': rng.randint(1, scale),
+            'user': f'user{user}' if user else 'admin',
+            'view_date': (start + timedelta(seconds=rng.randrange(span_seconds))).isoformat(),
+        }
+
+
+# база на каждый масштаб создается один раз и потом переиспользуется
+def prepare_database(workdir, scale, seed):
+    os.makedirs(workdir, exist_ok=True)
+    path = os.path.join(workdir, f'bench_{scale}_{seed}.db')
+    db_url = f'sqlite:///{path}'
+    if os.path.exists(path):
+        return init_db(db_url)
+
+    partial_path = path + '.partial'
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    started = time.perf_counter()
+    engine = init_db(f'sqlite:///{partial_path}')
+    BulkImporter(engine, progress=None).run_records(generate_records(scale, seed))
+    engine.dispose()
+    os.replace(partial_path, path)
+    print(f"  база на {scale} новостей создана за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+    return init_db(db_url)
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, *args):
+        self.count += 1
+
+
+def measure(fn, counter, repeats):
+    fn()  # прогрев: кэш страниц SQLite, импорты, шрифты Qt
+
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    # запросы и память считаем отдельным прогоном, чтобы tracemalloc не портил время
+    counter.count = 0
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'queries': counter.count,
+        'peak_python_kb': peak // 1024,
+    }
+
+
+def data_paths(engine, scale, seed):
+    rng = random.Random(seed)
+    service = NewsService(engine)
+    session = get_session(engine)
+    admin = find_user(session, 'admin', 'admin')
+    middle = (
+        session.query(GameNews.id, GameNews.date_posted)
+        .order_by(GameNews.date_posted.desc(), GameNews.id.desc())
+        .offset(scale // 2)
+        .first()
+    )
+
+    def fresh_session(fn):
+        def run():
+            run_session = get_session(engine)
+            try:
+                fn(run_session)
+            finally:
+                run_session.close()
+        return run
+
+    stats_service = StatsService(engine)
+
+    def statistics_uncached(run_session):
+        stats_service.invalidate()
+        stats_service.get(run_session)
+
+    session.close()
+    return {
+        'feed_first_page': fresh_session(lambda s: get_news_page(s)),
+        'feed_filtered_page': fresh_session(lambda s: get_news_page(s, 'Релизы', 'CS2')),
+        'feed_deep_page': fresh_session(lambda s: get_news_page(s, after=middle)),
+        'news_detail': lambda: service.news_detail(admin.id, rng.randint(1, scale)),
+        'search': fresh_session(lambda s: search_news(s, 'обновление баланс')),
+        'statistics': fresh_session(statistics_uncached),
+    }
+
+
+def wait_until(app, condition, timeout=120):
+    from PyQt5.QtCore import QEventLoop
+
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("Окно не дождалось данных")
+        app.processEvents(QEventLoop.AllEvents, 5)
+
+
+# те же сценарии через окна приложения: фоновые запросы, модель ленты, отрисовка
+def ui_paths(app, engine, scale, seed):
+    from main import MainApp, StatisticsWindow
+    from workers import DataLoader
+
+    rng = random.Random(seed)
+    service = NewsService(engine)
+    loader = DataLoader()
+    admin = service.login('admin', 'admin')
+    window = MainApp(admin, service, loader)
+    window.show()
+    wait_until(app, lambda: not window.news_model.loading)
+
+    def feed():
+        window.update_news()
+        wait_until(app, lambda: not window.news_model.loading)
+        window.scroll_area_list.viewport().repaint()
+
+    def detail():
+        news_id = rng.randint(1, scale)
+        window.show_news_detail(SimpleNamespace(id=news_id))
+        wait_until(app, lambda: window.current_news is not None and window.current_news.id == news_id)
+        window.news_detail_widget.repaint()
+
+    def statistics_window():
+        service.stats.invalidate()
+        stats_window = StatisticsWindow(service, loader)
+        stats_window.show()
+        wait_until(app, lambda: not stats_window.news_label.text().endswith("..."))
+        stats_window.close()
+
+    return {
+        'ui_feed': feed,
+        'ui_news_detail': detail,
+        'ui_statistics_window': statistics_window,
+    }, window
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scales, workdir, seed, repeats, include_ui=True):
+    app = None
+    if include_ui:
+        from PyQt5.QtWidgets import QApplication
+        from theme import apply_theme
+        from feed_snapshot import SNAPSHOT_PATH_ENV
+        app = QApplication.instance() or QApplication(sys.argv[:1])
+        apply_theme(app)
+        # окна бенчмарка сохраняют снимок ленты при закрытии - он не должен затереть снимок пользователя
+        os.makedirs(workdir, exist_ok=True)
+        os.environ[SNAPSHOT_PATH_ENV] = os.path.join(workdir, 'feed_snapshot.json')
+
+    results = {
+        'commit': git_commit(),
+        'created_at': datetime.utcnow().isoformat(),
+        'seed': seed,
+        'repeats': repeats,
+        'scales': {},
+    }
+    for scale in scales:
+        print(f"Масштаб {scale}:", file=sys.stderr)
+        engine = prepare_database(workdir, scale, seed)
+        counter = QueryCounter(engine)
+
+        paths = data_paths(engine, scale, seed)
+        window = None
+        if include_ui:
+            ui, window = ui_paths(app, engine, scale, seed)
+            paths.update(ui)
+
+        scale_results = {}
+        for name, fn in paths.items():
+            scale_results[name] = measure(fn, counter, repeats)
+            print(f"  {name}: {scale_results[name]}", file=sys.stderr)
+
+        if window is not None:
+            window.close()
+            window.loader.wait()
+        engine.dispose()
+        results['scales'][str(scale)] = {
+            'paths': scale_results,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+    return results
+
+
+# сравнение с прошлым прогоном: во сколько раз изменилась медиана
+def compare(previous, current):
+    for scale, scale_results in current['scales'].items():
+        old_paths = previous.get('scales', {}).get(scale, {}).get('paths', {})
+        for name, result in scale_results['paths'].items():
+            old = old_paths.get(name)
+            if not old or not old['median_ms']:
+                continue
+            ratio = result['median_ms'] / old['median_ms']
+            mark = "  <-- медленнее" if ratio > 1.2 else ""
+            print(f"{scale:>8} {name:<22} {old['median_ms']:>10.2f} -> {result['median_ms']:>10.2f} мс "
+                  f"(x{ratio:.2f}){mark}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Генератор тестовых данных и замеры ленты, новости и статистики")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="сколько новостей в базе")
+    parser.add_argument("--workdir", default="bench_data", help="куда складывать сгенерированные базы")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--repeats", type=int, default=20, help="сколько раз повторять каждый замер")
+    parser.add_argument("--no-ui", action="store_true", help="только запросы, без окон Qt")
+    parser.add_argument("--output", default="bench_results.json", help="файл с результатами в JSON")
+    parser.add_argument("--compare", help="прошлый файл результатов для сравнения")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.scales, args.workdir, args.seed, args.repeats, include_ui=not args.no_ui)
+    with open(args.output, "w", encoding="utf-8") as out:
+        json.dump(results, out, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as previous:
+            compare(json.load(previous), results)
+
+
+if __name__ == "__main__":
+    main()
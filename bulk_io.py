@@ -0,0 +1,249 @@
+import json
+import sys
+from datetime import datetime
+
+from sqlalchemy import select, func, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import (
+    User, GameNews, NewsImage, NewsView, NewsChange, make_snippet, NEWS_CHANGES_IMAGES_TRIGGER, BULK_IMPORT_TRIGGERS,
+    touch_bulk_import, get_bulk_import, finish_bulk_import,
+)
+
+# сколько записей вставляется одной транзакцией
+DEFAULT_BATCH_SIZE = 10000
+RECORD_TYPES = ('user', 'news', 'image', 'view')
+
+
+def parse_date(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def format_date(value):
+    return value.isoformat() if value else None
+
+
+def print_progress(action, count):
+    print(f"\r{action}: {count}", end='', file=sys.stderr, flush=True)
+
+
+# строки JSONL по одной: сначала пользователи и новости, чтобы при импорте ссылки уже существовали
+def export_jsonl(engine, out, batch_size=DEFAULT_BATCH_SIZE, progress=print_progress):
+    exports = [
+        (
+            select(User.username, User.password, User.role, User.registration_date).order_by(User.id),
+            lambda row: {
+                'type': 'user', 'username': row.username, 'password': row.password, 'role': row.role,
+                'registration_date': format_date(row.registration_date),
+            },
+        ),
+        (
+            select(
+                GameNews.id, GameNews.title, GameNews.content, GameNews.category, GameNews.game,
+                GameNews.date_posted, User.username,
+            ).outerjoin(User, User.id == GameNews.author_id).order_by(GameNews.id),
+            lambda row: {
+                'type': 'news', 'id': row.id, 'title': row.title, 'content': row.content,
+                'category': row.category, 'game': row.game, 'date_posted': format_date(row.date_posted),
+                'author': row.username,
+            },
+        ),
+        (
+            select(NewsImage.news_id, NewsImage.image_path, NewsImage.content_hash).order_by(NewsImage.id),
+            lambda row: {
+                'type': 'image', 'news_id': row.news_id, 'image_path': row.image_path,
+                'content_hash': row.content_hash,
+            },
+        ),
+        (
+            select(NewsView.news_id, NewsView.view_date, User.username)
+            .join(User, User.id == NewsView.user_id).order_by(NewsView.id),
+            lambda row: {
+                'type': 'view', 'news_id': row.news_id, 'user': row.username,
+                'view_date': format_date(row.view_date),
+            },
+        ),
+    ]
+
+    count = 0
+    with engine.connect() as conn:
+        for statement, to_record in exports:
+            # курсор на сервере: в памяти не больше одной пачки строк
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(statement)
+            for row in result:
+                out.write(json.dumps(to_record(row), ensure_ascii=False))
+                out.write('\n')
+                count += 1
+                if progress and count % batch_size == 0:
+                    progress("Выгружено", count)
+
+    if progress:
+        progress("Выгружено", count)
+        print(file=sys.stderr)
+    return count
+
+
+# импорт пачками: многострочные INSERT, одна транзакция на пачку, память не растет с размером файла
+class BulkImporter:
+    def __init__(self, engine, batch_size=DEFAULT_BATCH_SIZE, progress=print_progress):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.progress = progress
+        self.buffers = {record_type: [] for record_type in RECORD_TYPES}
+        self.pending = 0
+        self.imported = 0
+        self.views_imported = False
+        # max(id) новостей до загрузки; None, пока триггеры и индексы новостей не сняты.
+        # То же хранится в bulk_imports, чтобы упавшую загрузку довел следующий запуск
+        self.news_start_id = None
+        self.news_rewritten = False
+
+    def run(self, lines):
+        records = (json.loads(line) for line in lines if line.strip())
+        return self.run_records(records)
+
+    # записи-словари в том же формате, что и строки JSONL (так же грузит генератор в bench.py)
+    def run_records(self, records):
+        # прошлая загрузка упала только что и migrate ее еще не довел: триггеры уже сняты, продолжаем ее
+        with self.engine.connect() as conn:
+            state = get_bulk_import(conn)
+        if state is not None:
+            self.news_start_id = state.news_start_id
+        try:
+            for number, record in enumerate(records, start=1):
+                record_type = record.get('type')
+                if record_type not in self.buffers:
+                    raise ValueError(f"Запись {number}: неизвестный тип {record_type!r}")
+                self.buffers[record_type].append(record)
+                self.pending += 1
+                if self.pending >= self.batch_size:
+                    self.flush()
+            self.flush()
+        finally:
+            # и после ошибки: все, что успело закоммититься, попадает в FTS и счетчики, триггеры возвращаются
+            with self.engine.begin() as conn:
+                finish_bulk_import(conn)
+            self.news_start_id = None
+
+        if self.progress:
+            self.progress("Загружено", self.imported)
+            print(file=sys.stderr)
+        return self.imported
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        with self.engine.begin() as conn:
+            self.insert_users(conn, self.buffers['user'])
+            self.insert_news(conn, self.buffers['news'])
+            self.insert_images(conn, self.buffers['image'])
+            self.insert_views(conn, self.buffers['view'])
+            if self.news_start_id is not None or self.views_imported:
+                touch_bulk_import(conn, news_rewritten=self.news_rewritten, views_imported=self.views_imported)
+
+        self.imported += self.pending
+        self.pending = 0
+        for buffer in self.buffers.values():
+            buffer.clear()
+        if self.progress:
+            self.progress("Загружено", self.imported)
+
+    def user_ids(self, conn, usernames):
+        usernames = {name for name in usernames if name}
+        if not usernames:
+            return {}
+        rows = conn.execute(select(User.username, User.id).where(User.username.in_(usernames)))
+        return dict(rows.all())
+
+    def insert_users(self, conn, records):
+        if not records:
+            return
+        rows = [
+            {
+                'username': record['username'],
+                'password': record['password'],
+                'role': record.get('role') or 'Пользователь',
+                'registration_date': parse_date(record.get('registration_date')) or datetime.utcnow(),
+            }
+            for record in records
+        ]
+        # уже существующие пользователи остаются как есть
+        conn.execute(sqlite_insert(User).on_conflict_do_nothing(), rows)
+
+    def insert_news(self, conn, records):
+        if not records:
+            return
+        authors = self.user_ids(conn, (record.get('author') for record in records))
+        rows = [
+            {
+                'id': record.get('id'),
+                'title': record['title'],
+                'snippet': make_snippet(record['content']),
+                'content': record['content'],
+                'category': record['category'],
+                'game': record.get('game'),
+                'date_posted': parse_date(record.get('date_posted')) or datetime.utcnow(),
+                'author_id': authors.get(record.get('author')),
+                'view_count': 0,
+            }
+            for record in records
+        ]
+
+        if self.news_start_id is None:
+            self.start_news(conn)
+        explicit_ids = [row['id'] for row in rows if row['id'] is not None]
+        if explicit_ids and min(explicit_ids) <= self.news_start_id:
+            self.news_rewritten = True
+        conn.execute(GameNews.__table__.insert(), rows)
+
+    # на время всей загрузки с game_news сняты триггеры FTS, счетчиков фильтров и журнала изменений
+    # и индексы ленты: вставка идет в одну таблицу, а FTS и индексы строятся один раз в finish_bulk_import
+    def start_news(self, conn):
+        self.news_start_id = conn.execute(select(func.coalesce(func.max(GameNews.id), 0))).scalar()
+        touch_bulk_import(conn, news_start_id=self.news_start_id)
+        for trigger in BULK_IMPORT_TRIGGERS:
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+        for index in GameNews.__table__.indexes:
+            index.drop(conn, checkfirst=True)
+
+    # одна запись в журнале изменений вместо строки на каждую загруженную новость или картинку
+    def mark_reload(self, conn):
+        conn.execute(NewsChange.__table__.insert(), {'news_id': None, 'kind': 'reload'})
+
+    def insert_images(self, conn, records):
+        if not records:
+            return
+        rows = [
+            {
+                'news_id': record['news_id'],
+                'image_path': record['image_path'],
+                'content_hash': record.get('content_hash'),
+            }
+            for record in records
+        ]
+        conn.execute(text("DROP TRIGGER IF EXISTS news_changes_images_insert"))
+        conn.execute(NewsImage.__table__.insert(), rows)
+        self.mark_reload(conn)
+        conn.execute(text(NEWS_CHANGES_IMAGES_TRIGGER))
+
+    def insert_views(self, conn, records):
+        if not records:
+            return
+        users = self.user_ids(conn, (record.get('user') for record in records))
+        rows = [
+            {
+                'user_id': users[record['user']],
+                'news_id': record['news_id'],
+                'view_date': parse_date(record.get('view_date')) or datetime.utcnow(),
+            }
+            for record in records
+            if record.get('user') in users
+        ]
+        if rows:
+            conn.execute(sqlite_insert(NewsView).on_conflict_do_nothing(), rows)
+            self.views_imported = True
+
+
+def import_jsonl(engine, lines, batch_size=DEFAULT_BATCH_SIZE, progress=print_progress):
+    return BulkImporter(engine, batch_size, progress).run(lines)
@@ -0,0 +1,52 @@
+import json
+import os
+from datetime import datetime
+from types import SimpleNamespace
+
+# последняя показанная страница основной ленты: при следующем запуске она рисуется сразу,
+# а свежая страница из базы приходит следом. Модуль не тянет sqlalchemy, чтобы не тормозить запуск
+SNAPSHOT_PATH_ENV = 'KURSOVAY_FEED_SNAPSHOT'
+DEFAULT_SNAPSHOT_PATH = 'feed_snapshot.json'
+SNAPSHOT_VERSION = 2
+FEED_FIELDS = ('id', 'title', 'snippet', 'category', 'game', 'date_posted', 'author_name', 'views_count')
+
+
+# путь читается при каждом вызове: bench.py направляет снимок в свой каталог уже после импорта
+def snapshot_path():
+    return os.environ.get(SNAPSHOT_PATH_ENV, DEFAULT_SNAPSHOT_PATH)
+
+
+# source - адрес базы или сервера, с которого снята лента; снимок с другого источника не показывается
+def save_feed_snapshot(items, source, path=None):
+    path = path or snapshot_path()
+    rows = [[getattr(item, field) for field in FEED_FIELDS] for item in items]
+    for row in rows:
+        row[5] = row[5].isoformat()
+    data = {'version': SNAPSHOT_VERSION, 'source': source, 'fields': FEED_FIELDS, 'rows': rows}
+    # пишем во временный файл и подменяем: оборванная запись не оставит битый снимок
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as out:
+            json.dump(data, out, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, path)
+    except OSError:
+        return False
+    return True
+
+
+def load_feed_snapshot(source, path=None):
+    try:
+        with open(path or snapshot_path(), encoding='utf-8') as snapshot:
+            data = json.load(snapshot)
+    except (OSError, ValueError):
+        return None
+    if data.get('version') != SNAPSHOT_VERSION or tuple(data.get('fields', ())) != FEED_FIELDS:
+        return None
+    if data.get('source') != source:
+        return None
+    items = []
+    for row in data['rows']:
+        item = SimpleNamespace(**dict(zip(FEED_FIELDS, row)))
+        item.date_posted = datetime.fromisoformat(item.date_posted)
+        items.append(item)
+    return items
@@ -2,81 +2,86 @@ import sys
 import os
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QLineEdit, QPushButton, QLabel, QComboBox,
-    QScrollArea, QMenuBar, QMessageBox, QFrame, QStackedWidget, QHBoxLayout, QFileDialog,
-    QTextEdit, QDialog
+    QScrollArea, QMenuBar, QMessageBox, QStackedWidget, QHBoxLayout, QFileDialog,
+    QTextEdit, QDialog, QListView, QStyledItemDelegate, QStyle, QAbstractItemView, QPlainTextEdit, QCheckBox
 )
-from PyQt5.QtGui import QCursor, QPixmap
-from PyQt5.QtCore import Qt, pyqtSignal
-from models import User, GameNews, NewsImage, init_db, get_session, NewsView
+from PyQt5.QtGui import QCursor, QFont, QFontMetrics, QColor, QPainter, QPen
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QPoint, QRect, QSize, QTimer, pyqtSignal
+import profiling
+from profiling import profiled, profiler
+from workers import DataLoader, ImageLoader
+from theme import BASE_FONT, BASE_FONT_SIZE, apply_theme
+from feed_snapshot import load_feed_snapshot, save_feed_snapshot
 from datetime import datetime
+from collections import Counter
+# models, services и media_store тянут за собой sqlalchemy (полсекунды импорта), поэтому
+# они импортируются по месту: окно входа появляется раньше, чем загрузится слой данных
 
+
+# слой данных поднимается в фоне, пока пользователь вводит логин; учетка admin создается, как и раньше при запуске
+def open_service():
+    from services import create_service
+    service = create_service()
+    service.register('admin', 'admin', 'SECRET_KEY')
+    return service
+
+
+NEWS_CATEGORIES = ["Обновления", "Релизы", "Технические новости"]
+NEWS_GAMES = ["CS2", "DOTA2", "Deadlock"]
+# порядок ленты: по дате или по просмотрам за окно (ключи TRENDING_WINDOWS в models)
+FEED_SORTS = [("Сначала новые", None), ("Популярное за 24 ч", "24h"), ("Популярное за 7 дней", "7d")]
+
+
+# сумма счетчиков {(category, game): count} под фильтр; None в фильтре - любое значение
+def count_matching(counts, category=None, game=None):
+    return sum(
+        count for (news_category, news_game), count in counts.items()
+        if (category is None or news_category == category) and (game is None or news_game == game)
+    )
+
+
+# внешний вид задает общая таблица стилей из theme.py, здесь виджетам только ставятся свойства
 class StyledWidget:
-    base_font = "Arial"
-    base_font_size = 14
-
-    def get_button_style(self):
-        return '''
-            QPushButton {
-                background-color: #3a7bd5;
-                color: white;
-                font-family: Arial;
-                font-size: 14px;
-                font-weight: bold;
-                border-radius: 5px;
-                padding: 8px 12px;
-                margin: 5px;
-            }
-            QPushButton:hover {
-                background-color: #3572c4;
-            }
-            QPushButton:pressed {
-                background-color: #2f65aa;
-            }
-        '''
-
-    def get_label_style(self, bold=False):
-        return f'''
-            QLabel {{
-                font-family: '{self.base_font}';
-                font-size: {self.base_font_size}px;
-                color: #333;
-                {'font-weight: bold;' if bold else ''}
-                margin: 5px 0;
-            }}
-        '''
+    base_font = BASE_FONT
+    base_font_size = BASE_FONT_SIZE
+
+    def apply_window_style(self):
+        self.setProperty("appWindow", True)
 
     def create_label(self, text, bold=False, alignment=None):
         label = QLabel(text)
-        label.setStyleSheet(self.get_label_style(bold=bold))
+        label.setProperty("kind", "bold" if bold else "text")
         if alignment:
             label.setAlignment(alignment)
         return label
 
     def create_input(self, placeholder="", password=False):
         line_edit = QLineEdit(placeholderText=placeholder)
-        line_edit.setStyleSheet(f"font-family: {self.base_font}; font-size: {self.base_font_size}px; padding: 5px; margin:5px 0;")
+        line_edit.setProperty("kind", "input")
         if password:
             line_edit.setEchoMode(QLineEdit.Password)
         return line_edit
 
     def create_button(self, text, callback=None):
         button = QPushButton(text)
-        button.setStyleSheet(self.get_button_style())
+        button.setProperty("kind", "button")
         if callback:
             button.clicked.connect(callback)
         return button
 
 # окно авторизации
 class AuthApp(QWidget, StyledWidget):
-    def __init__(self):
+    def __init__(self, service=None):
         super().__init__()
         self.setWindowTitle('Авторизация')
         self.resize(350, 350)
-        self.engine = init_db()
-        self.session = get_session(self.engine)
+        self.service = service
+        self.loader = DataLoader(parent=self)
         self.mode = 'login'
+        self.apply_window_style()
         self.init_ui()
-        self.setStyleSheet("background-color: #f0f0f0;")
+        if self.service is None:
+            self.connect_service()
 
     def init_ui(self):
         self.layout = QVBoxLayout()
@@ -119,24 +124,49 @@ class AuthApp(QWidget, StyledWidget):
             self.secret_key_input.clear()
             self.message_label.setText("")
 
+    def connect_service(self):
+        self.login_button.setEnabled(False)
+        self.message_label.setText('Подключение...')
+        self.loader.submit('connect', open_service, on_result=self.on_service_ready, on_error=self.on_login_error)
+
+    def on_service_ready(self, service):
+        self.service = service
+        self.login_button.setEnabled(True)
+        self.message_label.setText('')
+
     def handle_action(self):
-        if self.mode == 'login':
+        if self.service is None:
+            self.connect_service()
+        elif self.mode == 'login':
             self.login()
         else:
             self.register()
 
+    @profiled()
     def login(self):
         username = self.username_input.text()
         password = self.password_input.text()
 
-        user = self.session.query(User).filter_by(username=username, password=password).first()
+        self.login_button.setEnabled(False)
+        self.message_label.setText('Вход...')
+        self.loader.submit('login', self.service.login, username, password,
+                           on_result=self.on_login_result, on_error=self.on_login_error)
+
+    @profiled()
+    def on_login_result(self, user):
+        self.login_button.setEnabled(True)
         if user:
+            self.message_label.setText('')
             self.close()
-            self.main_app = MainApp(user, self.session)
+            self.main_app = MainApp(user, self.service, self.loader)
             self.main_app.show()
         else:
             self.message_label.setText('Неверное имя пользователя или пароль.')
 
+    def on_login_error(self, error):
+        self.login_button.setEnabled(True)
+        self.message_label.setText(f'Ошибка подключения: {error}')
+
     def register(self, username=None, password=None, secret_key=None, show_message=True):
         if username is None:
             username = self.username_input.text()
@@ -150,18 +180,24 @@ class AuthApp(QWidget, StyledWidget):
                 self.message_label.setText('Пожалуйста, заполните все поля.')
             return
 
-        if self.session.query(User).filter_by(username=username).first():
-            if show_message:
-                self.message_label.setText('Пользователь уже существует.')
-            return
+        self.login_button.setEnabled(False)
+        self.loader.submit('register', self.service.register, username, password, secret_key,
+                           on_result=lambda user: self.on_register_result(user, show_message),
+                           on_error=self.on_register_error)
 
-        role = "Admin" if secret_key == "SECRET_KEY" else "Пользователь"
-        new_user = User(username=username, password=password, role=role)
-        self.session.add(new_user)
-        self.session.commit()
-        if show_message:
+    def on_register_result(self, user, show_message=True):
+        self.login_button.setEnabled(True)
+        if not show_message:
+            return
+        if user is None:
+            self.message_label.setText('Пользователь уже существует.')
+        else:
             self.message_label.setText('Регистрация успешна! Переключитесь назад к авторизации.')
 
+    def on_register_error(self, error):
+        self.login_button.setEnabled(True)
+        QMessageBox.warning(self, "Ошибка", f"Не удалось зарегистрироваться: {error}")
+
 
 # окно информации о пользователе
 class UserInfoWindow(QWidget, StyledWidget):
@@ -171,8 +207,8 @@ class UserInfoWindow(QWidget, StyledWidget):
         self.resize(300, 200)
         self.user = user
         self.main_app = main_app
+        self.apply_window_style()
         self.init_ui()
-        self.setStyleSheet("background-color: #f0f0f0;")
 
     def init_ui(self):
         layout = QVBoxLayout()
@@ -193,44 +229,70 @@ class UserInfoWindow(QWidget, StyledWidget):
 
 # окно статистики приложения
 class StatisticsWindow(QWidget, StyledWidget):
-    def __init__(self, session):
+    def __init__(self, service, loader):
         super().__init__()
         self.setWindowTitle("Статистика приложения")
-        self.resize(300, 300)
-        self.session = session
+        self.resize(350, 500)
+        self.service = service
+        self.loader = loader
+        self.apply_window_style()
         self.init_ui()
-        self.setStyleSheet("background-color: #f0f0f0;")
 
     def init_ui(self):
         layout = QVBoxLayout()
 
-        user_count = self.session.query(User).count()
-        news_count = self.session.query(GameNews).count()
-        views_count = self.session.query(NewsView).count()
-        images_count = self.session.query(NewsImage).count()
-        admins_count = self.session.query(User).filter_by(role='Admin').count()
-        regular_users_count = self.session.query(User).filter_by(role='Пользователь').count()
-
-        layout.addWidget(self.create_label(f"Количество пользователей: {user_count}", bold=True))
-        layout.addWidget(self.create_label(f"Количество администраторов: {admins_count}"))
-        layout.addWidget(self.create_label(f"Количество обычных пользователей: {regular_users_count}"))
-        layout.addWidget(self.create_label(f"Количество новостей: {news_count}", bold=True))
-        layout.addWidget(self.create_label(f"Всего просмотров новостей: {views_count}", bold=True))
-        layout.addWidget(self.create_label(f"Количество изображений к новостям: {images_count}", bold=True))
+        self.users_label = self.create_label("Количество пользователей: ...", bold=True)
+        self.admins_label = self.create_label("Количество администраторов: ...")
+        self.regular_users_label = self.create_label("Количество обычных пользователей: ...")
+        self.news_label = self.create_label("Количество новостей: ...", bold=True)
+        self.views_label = self.create_label("Всего просмотров новостей: ...", bold=True)
+        self.images_label = self.create_label("Количество изображений к новостям: ...", bold=True)
+        self.daily_label = self.create_label("")
+        self.games_label = self.create_label("")
+
+        layout.addWidget(self.users_label)
+        layout.addWidget(self.admins_label)
+        layout.addWidget(self.regular_users_label)
+        layout.addWidget(self.news_label)
+        layout.addWidget(self.views_label)
+        layout.addWidget(self.images_label)
+        layout.addWidget(self.create_label("По дням (новые статьи / просмотры):", bold=True))
+        layout.addWidget(self.daily_label)
+        layout.addWidget(self.create_label("По играм (статьи / просмотры):", bold=True))
+        layout.addWidget(self.games_label)
 
         self.setLayout(layout)
 
+        # счетчики считаются в фоне, окно открывается сразу
+        self.loader.submit('statistics', self.service.statistics, on_result=self.show_statistics)
+
+    def show_statistics(self, stats):
+        self.users_label.setText(f"Количество пользователей: {stats['users']}")
+        self.admins_label.setText(f"Количество администраторов: {stats['admins']}")
+        self.regular_users_label.setText(f"Количество обычных пользователей: {stats['regular_users']}")
+        self.news_label.setText(f"Количество новостей: {stats['news']}")
+        self.views_label.setText(f"Всего просмотров новостей: {stats['views']}")
+        self.images_label.setText(f"Количество изображений к новостям: {stats['images']}")
+        self.daily_label.setText(
+            "\n".join(f"{day}: {articles} / {views}" for day, articles, views in stats['daily']) or "нет данных"
+        )
+        self.games_label.setText(
+            "\n".join(f"{game or 'без игры'}: {articles} / {views}" for game, articles, views in stats['games'])
+            or "нет данных"
+        )
+
 # окно добавления новости в приложении
 class AddNewsWindow(QWidget, StyledWidget):
-    def __init__(self, session, user, on_news_added):
+    def __init__(self, service, loader, user, on_news_added):
         super().__init__()
         self.setWindowTitle("Добавить новость")
         self.resize(400, 300)
-        self.session = session
+        self.service = service
+        self.loader = loader
         self.user = user
         self.on_news_added = on_news_added
+        self.apply_window_style()
         self.init_ui()
-        self.setStyleSheet("background-color: #f0f0f0;")
 
     def init_ui(self):
         layout = QVBoxLayout()
@@ -238,14 +300,12 @@ class AddNewsWindow(QWidget, StyledWidget):
         self.title_input = self.create_input("Заголовок новости")
         self.content_input = self.create_input("Содержание новости")
         self.category_selector = QComboBox()
-        self.category_selector.addItems(["Обновления", "Релизы", "Технические новости"])
-        self.category_selector.setStyleSheet(self.get_label_style())
+        self.category_selector.addItems(NEWS_CATEGORIES)
 
         self.game_selector = QComboBox()
-        self.game_selector.setStyleSheet(self.get_label_style())
-        self.game_selector.addItems(["", "CS2", "DOTA2", "Deadlock"])
+        self.game_selector.addItems([""] + NEWS_GAMES)
 
-        save_button = self.create_button("Сохранить", self.save_news)
+        self.save_button = self.create_button("Сохранить", self.save_news)
         self.message_label = self.create_label("")
 
         layout.addWidget(self.title_input)
@@ -253,7 +313,7 @@ class AddNewsWindow(QWidget, StyledWidget):
         layout.addWidget(self.category_selector)
         layout.addWidget(QLabel("Игра (опционально):"))
         layout.addWidget(self.game_selector)
-        layout.addWidget(save_button)
+        layout.addWidget(self.save_button)
         layout.addWidget(self.message_label)
 
         self.setLayout(layout)
@@ -271,41 +331,307 @@ class AddNewsWindow(QWidget, StyledWidget):
         if game == "":
             game = None
 
-        new_news = GameNews(title=title, content=content, category=category, author_id=self.user.id, game=game)
-        self.session.add(new_news)
-        self.session.commit()
+        # запись идет в фоне: с сервером это HTTP-запрос, окно не должно висеть до ответа
+        self.save_button.setEnabled(False)
+        self.message_label.setText("Сохранение...")
+        self.loader.submit('add_news', self.service.add_news, self.user.id, title, content, category, game,
+                           on_result=self.on_news_saved, on_error=self.on_save_failed)
 
+    def on_news_saved(self, news_id):
         self.message_label.setText("Новость успешно добавлена!")
-        self.on_news_added()
+        self.on_news_added(news_id)
         self.close()
 
-# кликается, ура!
-class ClickableNewsWidget(QFrame, StyledWidget):
-    clicked = pyqtSignal()
+    def on_save_failed(self, error):
+        self.save_button.setEnabled(True)
+        self.message_label.setText("")
+        QMessageBox.warning(self, "Ошибка", f"Не удалось добавить новость: {error}")
+
+# модель ленты: хранит только данные, виджеты на каждую новость не создаются
+class NewsListModel(QAbstractListModel):
+    NewsRole = Qt.UserRole + 1
+    loading_changed = pyqtSignal(bool)
+
+    def __init__(self, loader, parent=None, page_size=None):
+        from models import NEWS_PAGE_SIZE
+        super().__init__(parent)
+        self.loader = loader
+        self.news_items = []
+        self.page_size = page_size or NEWS_PAGE_SIZE
+        self.fetch_page = None
+        self.matches = None
+        self.has_more = False
+        self.loading = False
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.news_items)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        item = self.news_items[index.row()]
+        if role == Qt.DisplayRole:
+            return item.title
+        if role == self.NewsRole:
+            return item
+        return None
+
+    # fetch_page(after, offset, limit) выполняется в фоне и возвращает следующую страницу;
+    # matches(item) - подходит ли новость под фильтр ленты (None в поиске: там порядок по релевантности);
+    # initial - сохраненная с прошлого запуска страница, она показывается, пока не придет свежая;
+    # empty - по счетчикам известно, что лента пуста, и загружать нечего
+    def set_source(self, fetch_page, matches=None, initial=None, empty=False):
+        self.beginResetModel()
+        self.news_items = list(initial or [])
+        self.fetch_page = fetch_page
+        self.matches = matches
+        self.has_more = not empty
+        self.set_loading(False)
+        self.endResetModel()
+        if empty:
+            return
+        if not initial:
+            self.fetchMore()
+            return
+        self.set_loading(True)
+        self.loader.submit('feed', self.fetch_page, None, 0, self.page_size,
+                           on_result=self.replace_page, on_error=lambda error: self.set_loading(False))
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.fetch_page is not None and self.has_more and not self.loading
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        after = self.news_items[-1] if self.news_items else None
+        self.set_loading(True)
+        # новый set_source отменяет еще не пришедшую страницу старого фильтра
+        self.loader.submit('feed', self.fetch_page, after, len(self.news_items), self.page_size,
+                           on_result=self.append_page, on_error=lambda error: self.set_loading(False))
+
+    @profiled()
+    def append_page(self, page):
+        self.has_more = len(page) >= self.page_size
+        if page:
+            first = len(self.news_items)
+            self.beginInsertRows(QModelIndex(), first, first + len(page) - 1)
+            self.news_items.extend(page)
+            self.endInsertRows()
+        self.set_loading(False)
+
+    # свежая первая страница вместо снимка: если состав строк тот же, прокрутка не сбрасывается
+    @profiled()
+    def replace_page(self, page):
+        self.has_more = len(page) >= self.page_size
+        if [item.id for item in page] == [item.id for item in self.news_items]:
+            self.news_items = page
+            if page:
+                self.dataChanged.emit(self.index(0), self.index(len(page) - 1))
+        else:
+            self.beginResetModel()
+            self.news_items = page
+            self.endResetModel()
+        self.set_loading(False)
+
+    def set_loading(self, loading):
+        if self.loading != loading:
+            self.loading = loading
+            self.loading_changed.emit(loading)
+
+    def news_at(self, index):
+        return self.news_items[index.row()]
+
+    def row_of(self, news_id):
+        return next((row for row, item in enumerate(self.news_items) if item.id == news_id), None)
+
+    # новая или измененная новость: правится одна строка, остальная лента и прокрутка не трогаются
+    def put_news(self, news_id, item):
+        row = self.row_of(news_id)
+        if item is None or (self.matches is not None and not self.matches(item)):
+            self.remove_news(news_id)
+            return
+
+        if row is not None:
+            self.news_items[row] = item
+            self.dataChanged.emit(self.index(row), self.index(row))
+            return
+
+        if self.matches is None:
+            return
+        key = (item.date_posted, item.id)
+        position = next(
+            (row for row, existing in enumerate(self.news_items) if (existing.date_posted, existing.id) < key),
+            len(self.news_items),
+        )
+        # место дальше загруженных страниц: новость придет вместе со своей страницей
+        if position == len(self.news_items) and self.has_more:
+            return
+        self.beginInsertRows(QModelIndex(), position, position)
+        self.news_items.insert(position, item)
+        self.endInsertRows()
+
+    def remove_news(self, news_id):
+        row = self.row_of(news_id)
+        if row is not None:
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.news_items[row]
+            self.endRemoveRows()
+
+
+# рисует карточку новости вместо QFrame с пачкой QLabel
+class NewsItemDelegate(QStyledItemDelegate):
+    margin = 5
+    padding = 10
+    line_margin = 5
+    content_lines = 3
 
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.setCursor(QCursor(Qt.PointingHandCursor))
+        self.font = QFont(StyledWidget.base_font)
+        self.font.setPixelSize(StyledWidget.base_font_size)
+        self.bold_font = QFont(self.font)
+        self.bold_font.setBold(True)
+        self.line_height = QFontMetrics(self.font).lineSpacing()
+
+    def sizeHint(self, option, index):
+        # высота карточки одинаковая: игра, заголовок, 3 строки текста, мета, автор, просмотры
+        lines = 5 + self.content_lines
+        height = lines * self.line_height + 6 * 2 * self.line_margin + 2 * (self.padding + self.margin)
+        return QSize(option.rect.width(), height)
+
+    def paint(self, painter, option, index):
+        item = index.data(NewsListModel.NewsRole)
+        if item is None:
+            return
+
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+
+        card = option.rect.adjusted(self.margin, self.margin, -self.margin, -self.margin)
+        background = QColor("#f7f9fc") if option.state & QStyle.State_MouseOver else QColor("#ffffff")
+        painter.setPen(QPen(QColor("#ccc"), 1))
+        painter.setBrush(background)
+        painter.drawRoundedRect(card, 5, 5)
+
+        text_rect = card.adjusted(self.padding, self.padding, -self.padding, -self.padding)
+        painter.setPen(QColor("#333"))
+        y = text_rect.top() + self.line_margin
+
+        def draw_line(text, font=self.font, lines=1, alignment=Qt.AlignLeft):
+            nonlocal y
+            painter.setFont(font)
+            rect = QRect(text_rect.left(), y, text_rect.width(), lines * self.line_height)
+            if lines > 1:
+                # текст переносится и обрезается по высоте прямоугольника
+                painter.drawText(rect, alignment | Qt.TextWordWrap, text)
+            else:
+                text = QFontMetrics(font).elidedText(text, Qt.ElideRight, text_rect.width())
+                painter.drawText(rect, alignment, text)
+            y += lines * self.line_height + 2 * self.line_margin
+
+        # Отображаем игру, если есть
+        if item.game:
+            draw_line(f"Игра: {item.game}")
+        draw_line(f"Заголовок: {item.title}", self.bold_font)
+        draw_line(f"Содержание: {' '.join(item.snippet.split())}", lines=self.content_lines)
+        draw_line(f"Категория: {item.category} | Дата: {item.date_posted.strftime('%Y-%m-%d %H:%M:%S')}")
+        draw_line(f"Автор: {item.author_name or 'Неизвестно'}", alignment=Qt.AlignRight)
+        draw_line(f"Просмотров: {item.views_count}")
+
+        painter.restore()
+
+# окно профилирования: последние замеры и самые дорогие операции
+class ProfilerWindow(QWidget, StyledWidget):
+    def __init__(self, service=None):
+        super().__init__()
+        self.setWindowTitle("Профилирование")
+        self.resize(700, 500)
+        self.service = service
+        self.apply_window_style()
+        self.init_ui()
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(1000)
+        self.refresh()
+
+    def init_ui(self):
+        layout = QVBoxLayout()
+        self.cache_label = self.create_label("")
+        layout.addWidget(self.cache_label)
+        layout.addWidget(self.create_label("Итого по операциям (кол-во / всего / среднее):", bold=True))
+        self.summary_view = QPlainTextEdit()
+        self.summary_view.setReadOnly(True)
+        layout.addWidget(self.summary_view)
+
+        layout.addWidget(self.create_label("Последние события:", bold=True))
+        self.events_view = QPlainTextEdit()
+        self.events_view.setReadOnly(True)
+        layout.addWidget(self.events_view)
+
+        self.save_button = self.create_button("Сохранить трассу", self.save_trace)
+        self.message_label = self.create_label("")
+        layout.addWidget(self.save_button)
+        layout.addWidget(self.message_label)
+        self.setLayout(layout)
+
+    def refresh(self):
+        # у клиента сервера своих кэшей нет, счетчики смотреть в /api/health
+        if hasattr(self.service, 'cache_stats'):
+            self.cache_label.setText("Кэш: " + ", ".join(
+                f"{name} {stats['hits']}/{stats['misses']} (в памяти {stats['size']})"
+                for name, stats in self.service.cache_stats().items()
+            ) + "  - попадания/промахи")
+        self.summary_view.setPlainText("\n".join(
+            f"{total * 1000:9.1f} мс  {count:6d}  {total * 1000 / count:8.2f} мс  [{category}] {name}"
+            for category, name, count, total in profiler.summary()[:50]
+        ))
+        self.events_view.setPlainText("\n".join(
+            f"{event['dur'] / 1000:8.2f} мс  [{event['cat']}] {event['name']}"
+            for event in reversed(profiler.recent())
+        ))
+
+    def save_trace(self):
+        path = profiler.write_trace()
+        self.message_label.setText(f"Трасса сохранена: {path} (открыть в chrome://tracing или Perfetto)")
 
-    def mousePressEvent(self, event):
-        if event.button() == Qt.LeftButton:
-            self.clicked.emit()
 
 # основное окно со всем
 class MainApp(QMainWindow, StyledWidget):
-    def __init__(self, user, session):
+    # как часто спрашивать базу о чужих изменениях; без изменений это одно чтение data_version
+    changes_poll_interval = 1000
+
+    def __init__(self, user, service, loader):
         super().__init__()
         self.user = user
-        self.session = session
+        self.service = service
+        self.loader = loader
         self.setWindowTitle('Новости')
         self.resize(800, 600)
+        self.feed_snapshot = load_feed_snapshot(self.service.source)
+        self.showing_default_feed = False
+        # пользователь, чье непрочитанное показывает лента; None - показываются все новости
+        self.feed_unread_for = None
+        # счетчики по парам (категория, игра); None, пока не пришли из базы
+        self.facet_counts = None
+        self.unread_counts = None
+        self.apply_window_style()
         self.init_ui()
-        self.setStyleSheet("background-color: #f0f0f0;")
 
         self.current_images = []
         self.current_image_index = 0
         self.current_news = None
 
+        self.last_change_id = None
+        self.changes_timer = QTimer(self)
+        self.changes_timer.setInterval(self.changes_poll_interval)
+        self.changes_timer.timeout.connect(self.poll_news_changes)
+        self.changes_timer.start()
+        self.poll_news_changes()
+        self.refresh_filter_counts()
+
     def init_ui(self):
         menu_bar = QMenuBar(self)
 
@@ -314,6 +640,10 @@ class MainApp(QMainWindow, StyledWidget):
         top_right_layout = QHBoxLayout()
         top_right_layout.setContentsMargins(0, 0, 0, 0)
         
+        if profiling.ENABLED:
+            self.profiler_button = self.create_button("Профилирование", self.show_profiler)
+            top_right_layout.addWidget(self.profiler_button)
+
         if self.user.role == "Admin":
             self.stats_button = self.create_button("Статистика", self.show_statistics)
             top_right_layout.addWidget(self.stats_button)
@@ -341,26 +671,63 @@ class MainApp(QMainWindow, StyledWidget):
             spacer.setFixedHeight(1)
             top_layout.addWidget(spacer)
 
+        # значение фильтра лежит в itemData, в тексте пункта еще и счетчики;
+        # список игр приходит из данных вместе со счетчиками
         self.category_selector = QComboBox()
-        self.category_selector.setStyleSheet(self.get_label_style())
-        self.category_selector.addItems(["Все новости", "Обновления", "Релизы", "Технические новости"])
-        self.category_selector.currentTextChanged.connect(self.update_news)
-        top_layout.addWidget(self.category_selector)
-
+        self.category_selector.addItem("Все новости", None)
+        for category in NEWS_CATEGORIES:
+            self.category_selector.addItem(category, category)
         self.game_selector = QComboBox()
-        self.game_selector.setStyleSheet(self.get_label_style())
-        self.game_selector.addItems(["Все игры", "CS2", "DOTA2", "Deadlock"])
-        self.game_selector.currentTextChanged.connect(self.update_news)
-        top_layout.addWidget(self.game_selector)
+        self.game_selector.addItem("Все игры", None)
+        for selector in (self.category_selector, self.game_selector):
+            selector.setToolTip("В скобках: всего новостей, +непрочитанные")
+            selector.setSizeAdjustPolicy(QComboBox.AdjustToContents)
+            selector.currentIndexChanged.connect(self.update_news)
+            top_layout.addWidget(selector)
+        self.sort_selector = QComboBox()
+        for label, sort in FEED_SORTS:
+            self.sort_selector.addItem(label, sort)
+        self.sort_selector.currentIndexChanged.connect(self.update_news)
+        top_layout.addWidget(self.sort_selector)
 
         self.news_list_layout.addLayout(top_layout)
 
-        self.scroll_area_list = QScrollArea()
-        self.scroll_area_list.setWidgetResizable(True)
-        self.news_container = QWidget()
-        self.news_layout = QVBoxLayout(self.news_container)
-        self.news_container.setLayout(self.news_layout)
-        self.scroll_area_list.setWidget(self.news_container)
+        # поиск по мере ввода: запрос уходит, когда пользователь перестал печатать
+        self.search_input = self.create_input("Поиск по новостям")
+        self.search_input.textChanged.connect(self.on_search_changed)
+        self.unread_checkbox = QCheckBox("Только непрочитанные")
+        self.unread_checkbox.toggled.connect(self.update_news)
+        search_layout = QHBoxLayout()
+        search_layout.addWidget(self.search_input, stretch=1)
+        search_layout.addWidget(self.unread_checkbox)
+        self.news_list_layout.addLayout(search_layout)
+
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(300)
+        self.search_timer.timeout.connect(self.update_news)
+
+        self.no_news_label = self.create_label("Нет доступных новостей.", bold=True, alignment=Qt.AlignCenter)
+        self.no_news_label.hide()
+        self.news_list_layout.addWidget(self.no_news_label)
+
+        # лента на модели/представлении: рисуются только видимые строки
+        self.news_model = NewsListModel(self.loader, self)
+        self.news_model.loading_changed.connect(self.update_feed_placeholder)
+        self.news_model.modelReset.connect(self.update_feed_placeholder)
+        self.news_model.rowsInserted.connect(self.on_news_rows_inserted)
+        self.news_model.rowsRemoved.connect(self.on_news_rows_removed)
+        self.scroll_area_list = QListView()
+        self.scroll_area_list.setModel(self.news_model)
+        self.scroll_area_list.setItemDelegate(NewsItemDelegate(self.scroll_area_list))
+        self.scroll_area_list.setUniformItemSizes(True)
+        self.scroll_area_list.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.scroll_area_list.setSelectionMode(QAbstractItemView.NoSelection)
+        self.scroll_area_list.setMouseTracking(True)
+        self.scroll_area_list.viewport().setCursor(QCursor(Qt.PointingHandCursor))
+        self.scroll_area_list.setObjectName("newsList")
+        self.scroll_area_list.clicked.connect(self.on_news_clicked)
+        self.scroll_area_list.verticalScrollBar().valueChanged.connect(self.on_news_scrolled)
         self.news_list_layout.addWidget(self.scroll_area_list)
         self.stacked_widget.addWidget(self.news_list_widget)
 
@@ -377,7 +744,7 @@ class MainApp(QMainWindow, StyledWidget):
         
         self.detail_text_view = QTextEdit()
         self.detail_text_view.setReadOnly(True)
-        self.detail_text_view.setStyleSheet("padding: 5px; font-size:14px;")
+        self.detail_text_view.setObjectName("newsText")
         self.detail_text_view.setFixedHeight(200)
 
         self.detail_meta = self.create_label("")
@@ -387,7 +754,10 @@ class MainApp(QMainWindow, StyledWidget):
 
         self.image_label = QLabel()
         self.image_label.setAlignment(Qt.AlignCenter)
-        self.image_label.setStyleSheet("margin:10px;")
+        self.image_label.setObjectName("newsImage")
+
+        self.image_loader = ImageLoader(QSize(300, 300), parent=self)
+        self.image_loader.image_loaded.connect(self.on_image_loaded)
 
         self.prev_image_button = self.create_button("←", self.show_prev_image)
         self.next_image_button = self.create_button("→", self.show_next_image)
@@ -438,104 +808,221 @@ class MainApp(QMainWindow, StyledWidget):
         self.load_news()
 
     def open_add_news_window(self):
-        self.add_news_window = AddNewsWindow(self.session, self.user, self.load_news)
+        self.add_news_window = AddNewsWindow(self.service, self.loader, self.user, self.on_news_changed)
         self.add_news_window.show()
 
-    def load_news(self, category=None, game=None):
-        for i in reversed(range(self.news_layout.count())):
-            widget = self.news_layout.itemAt(i).widget()
-            if widget:
-                widget.deleteLater()
-
-        query = self.session.query(GameNews)
+    @profiled()
+    def load_news(self, category=None, game=None, search_text="", unread_only=False, sort=None):
+        from models import make_fts_query
+        unread_for = self.user.id if unread_only else None
+        self.feed_unread_for = unread_for
+
+        def fetch_page(after, offset, limit):
+            return self.service.feed_page(category, game, search_text, after, offset, limit, unread_for, sort)
+
+        def matches(item):
+            return (category is None or item.category == category) and (game is None or item.game == game)
+
+        searching = bool(make_fts_query(search_text))
+        # первая страница ленты без фильтров переживает перезапуск в снимке
+        self.showing_default_feed = (category is None and game is None and not searching and not unread_only
+                                     and sort is None)
+        initial = None
+        if self.showing_default_feed:
+            initial, self.feed_snapshot = self.feed_snapshot, None
+        # пустое сочетание фильтров видно по счетчикам, за пустой страницей в базу не ходим
+        counts = self.unread_counts if unread_only else self.facet_counts
+        empty = not searching and counts is not None and count_matching(counts, category, game) == 0
+        # в поиске и в популярном порядок не по дате: новые новости в ленту не вставляются
+        ordered_by_date = not searching and sort is None
+        self.news_model.set_source(fetch_page, matches if ordered_by_date else None, initial, empty)
+
+    # событие об одной новости (добавлена, изменена, удалена): лента не перезагружается целиком
+    def on_news_changed(self, news_id, deleted=False):
+        self.refresh_filter_counts()
+        if deleted:
+            self.news_model.remove_news(news_id)
+            return
+        # в ленте непрочитанного уже прочитанная новость приходит как None и убирается из списка
+        self.loader.submit(f'news_item:{news_id}', self.service.feed_item, news_id, self.feed_unread_for,
+                           on_result=lambda item: self.news_model.put_news(news_id, item))
+
+    def poll_news_changes(self):
+        if not self.loader.is_running('changes'):
+            self.loader.submit('changes', self.service.news_changes, self.last_change_id,
+                               on_result=self.apply_news_changes)
+
+    # изменения других клиентов: правятся только затронутые строки ленты и открытая новость
+    def apply_news_changes(self, result):
+        first_poll = self.last_change_id is None
+        self.last_change_id = result['last_id']
+        if first_poll:
+            return
+        if result['reload']:
+            self.update_news()
+            self.refresh_filter_counts()
+            return
 
-        if category and category != "Все новости":
-            query = query.filter_by(category=category)
+        for news_id, kind in result['changes']:
+            deleted = kind == 'delete'
+            self.on_news_changed(news_id, deleted)
+            showing = self.stacked_widget.currentWidget() is self.news_detail_widget
+            if not showing or self.current_news is None or self.current_news.id != news_id:
+                continue
+            if deleted:
+                self.back_to_list()
+            elif self.detail_text_view.isReadOnly():
+                self.loader.submit('detail', self.service.news_detail, self.user.id, news_id,
+                                   on_result=self.fill_news_detail,
+                                   on_error=lambda error, news_id=news_id: self.on_detail_failed(news_id, error))
+
+    # счетчики фильтров пересчитываются в фоне; одновременно идет только последний запрос каждого вида
+    def refresh_filter_counts(self):
+        self.loader.submit('facet_counts', self.service.facet_counts, on_result=self.show_facet_counts)
+        self.loader.submit('unread_counts', self.service.unread_counts, self.user.id,
+                           on_result=self.show_unread_counts)
+
+    def show_facet_counts(self, rows):
+        self.facet_counts = Counter({(category, game): count for category, game, count in rows})
+        self.update_selectors()
+
+    def show_unread_counts(self, rows):
+        self.unread_counts = Counter({(category, game): count for category, game, count in rows})
+        self.update_selectors()
+
+    # пункты и числа на фильтрах; число у пункта учитывает то, что выбрано во втором фильтре
+    def update_selectors(self):
+        if self.facet_counts is None:
+            return
+        categories = {category for category, game in self.facet_counts}
+        games = {game for category, game in self.facet_counts if game}
+        self.fill_selector(self.category_selector, "Все новости",
+                           NEWS_CATEGORIES + sorted(categories - set(NEWS_CATEGORIES)))
+        self.fill_selector(self.game_selector, "Все игры", sorted(games))
+
+        category = self.category_selector.currentData()
+        game = self.game_selector.currentData()
+        for index in range(self.category_selector.count()):
+            value = self.category_selector.itemData(index)
+            self.category_selector.setItemText(index, self.filter_label(value or "Все новости", value, game))
+        for index in range(self.game_selector.count()):
+            value = self.game_selector.itemData(index)
+            self.game_selector.setItemText(index, self.filter_label(value or "Все игры", category, value))
+
+        unread = count_matching(self.unread_counts or {}, category, game)
+        self.unread_checkbox.setText(f"Только непрочитанные ({unread})" if unread else "Только непрочитанные")
+
+    # пункты пересоздаются, только если изменился сам список; выбранное значение остается в нем всегда
+    def fill_selector(self, selector, all_label, values):
+        current = selector.currentData()
+        if current is not None and current not in values:
+            values = values + [current]
+        if [selector.itemData(index) for index in range(1, selector.count())] == values:
+            return
+        selector.blockSignals(True)
+        selector.clear()
+        selector.addItem(all_label, None)
+        for value in values:
+            selector.addItem(value, value)
+        selector.setCurrentIndex(max(selector.findData(current), 0))
+        selector.blockSignals(False)
+
+    def filter_label(self, label, category, game):
+        total = count_matching(self.facet_counts, category, game)
+        unread = count_matching(self.unread_counts or {}, category, game)
+        if unread:
+            return f"{label} ({total}, +{unread})"
+        return f"{label} ({total})"
+
+    # строки, вставленные или удаленные выше видимой области, не должны сдвигать то, что читают
+    def on_news_rows_inserted(self, parent, first, last):
+        self.keep_scroll_position(first, last - first + 1)
+
+    def on_news_rows_removed(self, parent, first, last):
+        self.keep_scroll_position(first, -(last - first + 1))
+
+    def keep_scroll_position(self, first, rows):
+        self.update_feed_placeholder()
+        scroll_bar = self.scroll_area_list.verticalScrollBar()
+        top_row = self.scroll_area_list.indexAt(QPoint(0, 0)).row()
+        if scroll_bar.value() == 0 or top_row < 0 or first > top_row:
+            return
+        self.scroll_area_list.doItemsLayout()
+        scroll_bar.setValue(scroll_bar.value() + rows * self.scroll_area_list.sizeHintForRow(0))
 
-        if game and game != "Все игры":
-            query = query.filter_by(game=game)
+    def update_feed_placeholder(self):
+        has_news = self.news_model.rowCount() > 0
+        if self.news_model.loading and not has_news:
+            self.no_news_label.setText("Загрузка новостей...")
+        else:
+            self.no_news_label.setText("Нет доступных новостей.")
+        self.no_news_label.setVisible(not has_news)
+        self.scroll_area_list.setVisible(has_news)
 
-        news_items = query.order_by(GameNews.date_posted.desc()).all()
+    def on_search_changed(self):
+        self.search_timer.start()
 
-        if not news_items:
-            no_news_label = self.create_label("Нет доступных новостей.", bold=True, alignment=Qt.AlignCenter)
-            self.news_layout.addWidget(no_news_label)
-            return
+    def on_news_scrolled(self, value):
+        # подгружаем следующую страницу заранее, когда до конца осталось меньше экрана
+        scroll_bar = self.scroll_area_list.verticalScrollBar()
+        if scroll_bar.maximum() - value < self.scroll_area_list.viewport().height():
+            self.news_model.fetchMore()
 
-        for item in news_items:
-            author_name = self.get_author(item.author_id)
-            views_count = len(item.views)  # Количество уникальных просмотров
-
-            news_widget = ClickableNewsWidget()
-            nw_layout = QVBoxLayout(news_widget)
-
-            title_label = self.create_label(f"Заголовок: {item.title}", bold=True)
-            content_label = self.create_label(f"Содержание: {item.content}")
-            content_label.setWordWrap(True)
-            meta_label = self.create_label(
-                f"Категория: {item.category} | Дата: {item.date_posted.strftime('%Y-%m-%d %H:%M:%S')}"
-            )
-            author_label = self.create_label(f"Автор: {author_name}")
-            author_label.setAlignment(Qt.AlignRight | Qt.AlignBottom)
-            views_label = self.create_label(f"Просмотров: {views_count}")
-
-            # Отображаем игру, если есть
-            if item.game:
-                game_label = self.create_label(f"Игра: {item.game}")
-                nw_layout.addWidget(game_label)
-
-            nw_layout.addWidget(title_label)
-            nw_layout.addWidget(content_label)
-            nw_layout.addWidget(meta_label)
-            nw_layout.addWidget(author_label)
-            nw_layout.addWidget(views_label)
-
-            news_widget.setStyleSheet(
-                "border: 1px solid #ccc; "
-                "border-radius: 5px; "
-                "padding: 10px; "
-                "margin: 5px; "
-                "background-color: #ffffff;"
-            )
-
-            def on_clicked(item=item):
-                self.show_news_detail(item)
-
-            news_widget.clicked.connect(on_clicked)
-            self.news_layout.addWidget(news_widget)
-
-        self.news_layout.addStretch()
-
-    def get_author(self, author_id):
-        user = self.session.query(User).filter(User.id == author_id).first()
-        return user.username if user else "Неизвестно"
+    def on_news_clicked(self, index):
+        if index.isValid():
+            self.show_news_detail(self.news_model.news_at(index))
 
+    @profiled()
     def show_news_detail(self, news_item):
-        self.current_news = news_item
-        author_name = self.get_author(news_item.author_id)
-        self.detail_title.setText(f"Заголовок: {news_item.title}")
+        self.detail_title.setText("Загрузка...")
         self.detail_text_view.setReadOnly(True)
-        self.detail_text_view.setText(news_item.content)
-        self.detail_meta.setText(f"Категория: {news_item.category} | Дата: {news_item.date_posted.strftime('%Y-%m-%d %H:%M:%S')}")
-        self.detail_author.setText(f"Автор: {author_name}")
+        self.detail_text_view.clear()
+        for label in (self.detail_meta, self.detail_author, self.detail_game, self.detail_views):
+            label.clear()
+        self.current_news = None
+        self.current_images = []
+        self.update_image_display()
+        for button in (self.add_images_button, self.edit_button, self.save_changes_button):
+            button.hide()
+        self.stacked_widget.setCurrentWidget(self.news_detail_widget)
 
-        if news_item.game:
-            self.detail_game.setText(f"Игра: {news_item.game}")
+        # просмотр засчитывается один раз на пользователя, новость грузится в фоне
+        self.loader.submit('detail', self.service.news_detail, self.user.id, news_item.id,
+                           on_result=self.fill_news_detail,
+                           on_error=lambda error: self.on_detail_failed(news_item.id, error))
+
+    # новость не загрузилась: пользователь возвращается к списку; строка убирается, только если новости
+    # больше нет (удалена другим клиентом, устаревший снимок), а не при занятой базе или недоступном сервере
+    def on_detail_failed(self, news_id, error):
+        from services import is_not_found
+        self.back_to_list()
+        if is_not_found(error):
+            self.on_news_changed(news_id, deleted=True)
+            QMessageBox.warning(self, "Ошибка", "Новость не найдена: возможно, ее уже удалили.")
+        else:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось открыть новость: {error}")
+
+    @profiled()
+    def fill_news_detail(self, news):
+        self.current_news = news
+        # первое открытие: счетчики уменьшаются сразу, не дожидаясь записи просмотра в базу
+        if news.first_view and self.unread_counts and self.unread_counts[(news.category, news.game)] > 0:
+            self.unread_counts[(news.category, news.game)] -= 1
+            self.update_selectors()
+
+        self.detail_title.setText(f"Заголовок: {news.title}")
+        self.detail_text_view.setText(news.content)
+        self.detail_meta.setText(f"Категория: {news.category} | Дата: {news.date_posted.strftime('%Y-%m-%d %H:%M:%S')}")
+        self.detail_author.setText(f"Автор: {news.author_name or 'Неизвестно'}")
+
+        if news.game:
+            self.detail_game.setText(f"Игра: {news.game}")
         else:
             self.detail_game.setText("Игра: не указано")
 
-        # проверяем просмотры
-        already_viewed = self.session.query(NewsView).filter_by(user_id=self.user.id, news_id=news_item.id).first()
-        if not already_viewed:
-            new_view = NewsView(user_id=self.user.id, news_id=news_item.id)
-            self.session.add(new_view)
-            self.session.commit()
-            self.current_news = self.session.query(GameNews).filter_by(id=news_item.id).one()
+        self.detail_views.setText(f"Просмотров: {news.views_count}")
 
-        views_count = len(self.current_news.views)
-        self.detail_views.setText(f"Просмотров: {views_count}")
-
-        self.current_images = self.current_news.images
+        self.current_images = news.images
         self.current_image_index = 0
         self.update_image_display()
 
@@ -548,9 +1035,9 @@ class MainApp(QMainWindow, StyledWidget):
 
         self.save_changes_button.hide()
 
-        self.stacked_widget.setCurrentWidget(self.news_detail_widget)
-
+    @profiled()
     def update_image_display(self):
+        from media_store import display_path
         if not self.current_images:
             self.image_label.clear()
             self.prev_image_button.hide()
@@ -563,13 +1050,21 @@ class MainApp(QMainWindow, StyledWidget):
         if self.current_image_index >= len(self.current_images):
             self.current_image_index = len(self.current_images) - 1
 
-        img_record = self.current_images[self.current_image_index]
-        if os.path.exists(img_record.image_path):
-            pix = QPixmap(img_record.image_path)
-            self.image_label.setPixmap(pix.scaled(300, 300, Qt.KeepAspectRatio))
+        image_path = display_path(self.current_images[self.current_image_index])
+        pixmap = self.image_loader.get(image_path)
+        if pixmap is not None:
+            self.image_label.setPixmap(pixmap)
+        elif os.path.exists(image_path):
+            self.image_label.setText("Загрузка изображения...")
+            self.image_loader.load(image_path)
         else:
             self.image_label.setText("Изображение не найдено")
 
+        # соседние картинки декодируем заранее, чтобы стрелки переключали мгновенно
+        for neighbour in (self.current_image_index - 1, self.current_image_index + 1):
+            if 0 <= neighbour < len(self.current_images):
+                self.image_loader.load(display_path(self.current_images[neighbour]))
+
         if len(self.current_images) > 1:
             self.prev_image_button.show()
             self.next_image_button.show()
@@ -582,20 +1077,41 @@ class MainApp(QMainWindow, StyledWidget):
         else:
             self.delete_image_button.hide()
 
+    @profiled()
+    def on_image_loaded(self, path, pixmap):
+        from media_store import display_path
+        if not self.current_images:
+            return
+        if display_path(self.current_images[self.current_image_index]) != path:
+            return
+        if pixmap.isNull():
+            self.image_label.setText("Изображение не найдено")
+        else:
+            self.image_label.setPixmap(pixmap)
+
     def back_to_list(self):
+        self.loader.cancel('detail')
         self.stacked_widget.setCurrentWidget(self.news_list_widget)
 
     def add_images(self):
         files, _ = QFileDialog.getOpenFileNames(self, "Выбрать изображения", "", "Images (*.png *.xpm *.jpg)")
+        files = [f for f in files if os.path.exists(f)]
         if files:
-            for f in files:
-                if os.path.exists(f):
-                    new_img = NewsImage(news_id=self.current_news.id, image_path=f)
-                    self.session.add(new_img)
-            self.session.commit()
-            self.current_news = self.session.query(GameNews).filter_by(id=self.current_news.id).one()
+            # копирование в хранилище и превью делаются в фоне
+            news_id = self.current_news.id
+            self.add_images_button.setEnabled(False)
+            self.loader.submit(f'add_images:{news_id}', self.service.add_images, news_id, files,
+                               on_result=self.on_images_added, on_error=self.on_images_failed)
+
+    def on_images_added(self, news_id):
+        self.add_images_button.setEnabled(True)
+        if self.current_news and self.current_news.id == news_id:
             self.show_news_detail(self.current_news)
 
+    def on_images_failed(self, error):
+        self.add_images_button.setEnabled(True)
+        QMessageBox.warning(self, "Ошибка", f"Не удалось добавить изображения: {error}")
+
     def delete_current_image(self):
         if not self.current_images:
             return
@@ -605,14 +1121,23 @@ class MainApp(QMainWindow, StyledWidget):
         reply = QMessageBox.question(self, "Удалить", "Удалить это изображение?",
                                      QMessageBox.Yes | QMessageBox.No)
         if reply == QMessageBox.Yes:
-            self.session.delete(img_to_delete)
-            self.session.commit()
+            news_id = self.current_news.id
+            self.loader.submit(f'delete_image:{img_to_delete.id}', self.service.delete_image, img_to_delete.id,
+                               on_result=lambda images: self.on_image_deleted(news_id, images),
+                               on_error=self.on_image_delete_failed)
+
+    def on_image_deleted(self, news_id, images):
+        # файлы, на которые больше никто не ссылается, убираются из хранилища в фоне
+        self.loader.submit('media_gc', self.service.collect_media)
+        if self.current_news is None or self.current_news.id != news_id:
+            return
+        self.current_images = images
+        if self.current_image_index >= len(self.current_images):
+            self.current_image_index = len(self.current_images) - 1
+        self.update_image_display()
 
-            self.current_news = self.session.query(GameNews).filter_by(id=self.current_news.id).one()
-            self.current_images = self.current_news.images
-            if self.current_image_index >= len(self.current_images):
-                self.current_image_index = len(self.current_images) - 1
-            self.update_image_display()
+    def on_image_delete_failed(self, error):
+        QMessageBox.warning(self, "Ошибка", f"Не удалось удалить изображение: {error}")
 
     def show_prev_image(self):
         if self.current_images:
@@ -625,23 +1150,24 @@ class MainApp(QMainWindow, StyledWidget):
             self.update_image_display()
 
     def update_news(self):
-        category = self.category_selector.currentText()
-        if category == "Все новости":
-            category = None
-
-        selected_game = self.game_selector.currentText()
-        if selected_game == "Все игры":
-            selected_game = None
-
-        self.load_news(category, selected_game)
+        self.search_timer.stop()
+        self.update_selectors()
+        self.load_news(self.category_selector.currentData(), self.game_selector.currentData(),
+                       self.search_input.text(), self.unread_checkbox.isChecked(), self.sort_selector.currentData())
 
     def show_user_info(self):
         self.user_info_window = UserInfoWindow(self.user, self)
         self.user_info_window.show()
 
+    def closeEvent(self, event):
+        self.changes_timer.stop()
+        if self.showing_default_feed and self.news_model.news_items:
+            save_feed_snapshot(self.news_model.news_items[:self.news_model.page_size], self.service.source)
+        super().closeEvent(event)
+
     def logout(self):
         self.close()
-        self.auth_window = AuthApp()
+        self.auth_window = AuthApp(self.service)
         self.auth_window.show()
 
     def edit_news(self):
@@ -654,27 +1180,41 @@ class MainApp(QMainWindow, StyledWidget):
             QMessageBox.warning(self, "Ошибка", "Содержимое новости не может быть пустым.")
             return
 
-        self.current_news.content = new_content
-        self.session.commit()
-
-        self.detail_text_view.setReadOnly(True)
-        self.save_changes_button.hide()
-
-        # Обновляем список новостей и детальный вид
-        self.load_news()
-        self.show_news_detail(self.current_news)
+        news = self.current_news
+        self.save_changes_button.setEnabled(False)
+        self.loader.submit(f'save_news:{news.id}', self.service.update_news_content, news.id, new_content,
+                           on_result=lambda result: self.on_changes_saved(news, new_content),
+                           on_error=self.on_changes_failed)
+
+    def on_changes_saved(self, news, new_content):
+        self.save_changes_button.setEnabled(True)
+        # в детальном виде уже новый текст, в ленте обновляется только эта новость
+        news.content = new_content
+        self.on_news_changed(news.id)
+        if self.current_news is news:
+            self.detail_text_view.setReadOnly(True)
+            self.save_changes_button.hide()
 
         QMessageBox.information(self, "Успех", "Изменения сохранены.")
 
+    def on_changes_failed(self, error):
+        # текст остается в редакторе, сохранение можно повторить
+        self.save_changes_button.setEnabled(True)
+        QMessageBox.warning(self, "Ошибка", f"Не удалось сохранить изменения: {error}")
+
     def show_statistics(self):
-        self.stats_window = StatisticsWindow(self.session)
+        self.stats_window = StatisticsWindow(self.service, self.loader)
         self.stats_window.show()
 
+    def show_profiler(self):
+        self.profiler_window = ProfilerWindow(self.service)
+        self.profiler_window.show()
+
 
 # запуск приложения
 if __name__ == '__main__':
     app = QApplication(sys.argv)
+    apply_theme(app)
     window = AuthApp()
-    window.register('admin', 'admin', 'SECRET_KEY',show_message=False)
     window.show()
     sys.exit(app.exec_())
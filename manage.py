@@ -0,0 +1,113 @@
+import argparse
+import sys
+
+from bulk_io import DEFAULT_BATCH_SIZE, export_jsonl, import_jsonl
+from media_store import MEDIA_ROOT, GC_GRACE_SECONDS, collect_unused_media
+from models import (
+    init_db, get_session, rebuild_view_counts, rebuild_view_rollups, rebuild_read_facets, compact_view_rollups,
+)
+from server import DEFAULT_HOST, DEFAULT_PORT, DEFAULT_WORKERS, run_server
+from services import NewsService
+
+
+def rebuild_view_counts_command(args):
+    engine = init_db(args.db)
+    with engine.begin() as conn:
+        rebuild_view_counts(conn)
+        rebuild_view_rollups(conn)
+        rebuild_read_facets(conn)
+    print("Счетчики просмотров пересчитаны.")
+
+
+def compact_view_rollups_command(args):
+    engine = init_db(args.db)
+    with engine.begin() as conn:
+        compact_view_rollups(conn)
+    print("Корзины просмотров сжаты.")
+
+
+def gc_media_command(args):
+    engine = init_db(args.db)
+    session = get_session(engine)
+    try:
+        removed = collect_unused_media(session, args.media_root, args.grace)
+    finally:
+        session.close()
+    print(f"Удалено неиспользуемых файлов: {removed}")
+
+
+def export_command(args):
+    engine = init_db(args.db)
+    if args.output == "-":
+        export_jsonl(engine, sys.stdout, args.batch_size)
+    else:
+        with open(args.output, "w", encoding="utf-8") as out:
+            export_jsonl(engine, out, args.batch_size)
+
+
+def import_command(args):
+    engine = init_db(args.db)
+    if args.input == "-":
+        import_jsonl(engine, sys.stdin, args.batch_size)
+    else:
+        with open(args.input, encoding="utf-8") as lines:
+            import_jsonl(engine, lines, args.batch_size)
+
+
+def serve_command(args):
+    run_server(NewsService(init_db(args.db)), args.host, args.port, args.workers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Служебные команды для базы новостей")
+    parser.add_argument("--db", default="sqlite:///users.db", help="адрес базы данных SQLAlchemy")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_parser = subparsers.add_parser(
+        "rebuild-view-counts", help="пересчитать game_news.view_count и корзины просмотров по таблице news_views"
+    )
+    rebuild_parser.set_defaults(handler=rebuild_view_counts_command)
+
+    compact_parser = subparsers.add_parser(
+        "compact-view-rollups", help="слить почасовые корзины просмотров старше суток в суточные, удалить старые"
+    )
+    compact_parser.set_defaults(handler=compact_view_rollups_command)
+
+    gc_parser = subparsers.add_parser(
+        "gc-media", help="удалить из хранилища картинок файлы без ссылок из news_images"
+    )
+    gc_parser.add_argument("--media-root", default=MEDIA_ROOT, help="каталог хранилища картинок")
+    gc_parser.add_argument("--grace", type=int, default=GC_GRACE_SECONDS, help="не трогать файлы моложе стольких секунд")
+    gc_parser.set_defaults(handler=gc_media_command)
+
+    export_parser = subparsers.add_parser(
+        "export", help="выгрузить пользователей, новости, картинки и просмотры в JSONL"
+    )
+    export_parser.add_argument("output", nargs="?", default="-", help="файл JSONL, по умолчанию stdout")
+    export_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                               help="сколько строк читать из базы за раз")
+    export_parser.set_defaults(handler=export_command)
+
+    import_parser = subparsers.add_parser(
+        "import", help="загрузить JSONL (формат как у export); id новостей сохраняются"
+    )
+    import_parser.add_argument("input", nargs="?", default="-", help="файл JSONL, по умолчанию stdin")
+    import_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                               help="сколько записей вставлять в одной транзакции")
+    import_parser.set_defaults(handler=import_command)
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="HTTP/JSON сервер для окон (KURSOVAY_API_URL=http://host:port)"
+    )
+    serve_parser.add_argument("--host", default=DEFAULT_HOST)
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                              help="сколько запросов к базе выполнять параллельно")
+    serve_parser.set_defaults(handler=serve_command)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
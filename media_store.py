@@ -0,0 +1,153 @@
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from models import NewsImage
+
+# хранилище картинок лежит рядом с users.db: media/originals/ab/<sha256>.jpg
+MEDIA_ROOT = 'media'
+# готовые уменьшенные копии: для списков и для карусели в детальном просмотре
+RENDITIONS = {
+    'thumb': 160,
+    'preview': 300,
+}
+# свежие файлы не трогаем: их могли только что скопировать, а запись в базу еще не сделана
+GC_GRACE_SECONDS = 600
+
+
+def blob_path(content_hash, extension, root=MEDIA_ROOT):
+    return os.path.join(root, 'originals', content_hash[:2], content_hash + extension)
+
+
+def rendition_path(content_hash, name, root=MEDIA_ROOT):
+    return os.path.join(root, name, content_hash[:2], content_hash + '.png')
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# пишем во временный файл и переименовываем, чтобы никто не увидел недописанный файл
+def atomic_write(target, write):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.', suffix='.tmp')
+    os.close(fd)
+    try:
+        write(temp_path)
+        os.replace(temp_path, target)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def make_renditions(source, content_hash, root=MEDIA_ROOT):
+    # Qt импортируется здесь: функция выполняется в отдельном процессе без QApplication
+    from PyQt5.QtCore import Qt, QSize
+    from PyQt5.QtGui import QImageReader
+
+    for name, size in RENDITIONS.items():
+        target = rendition_path(content_hash, name, root)
+        if os.path.exists(target):
+            continue
+
+        reader = QImageReader(source)
+        reader.setAutoTransform(True)
+        original_size = reader.size()
+        if original_size.isValid():
+            reader.setScaledSize(original_size.scaled(QSize(size, size), Qt.KeepAspectRatio))
+        image = reader.read()
+        if image.isNull():
+            continue
+        if not original_size.isValid():
+            image = image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+        def save(temp_path):
+            if not image.save(temp_path, 'PNG'):
+                raise OSError(f"Не удалось сохранить {target}")
+
+        atomic_write(target, save)
+
+
+# копирует файл в хранилище (одинаковые файлы хранятся один раз) и готовит уменьшенные копии
+def ingest_file(path, root=MEDIA_ROOT):
+    content_hash = file_hash(path)
+    extension = os.path.splitext(path)[1].lower()
+    stored_path = blob_path(content_hash, extension, root)
+
+    if os.path.exists(stored_path):
+        os.utime(stored_path)
+    else:
+        atomic_write(stored_path, lambda temp_path: shutil.copyfile(path, temp_path))
+
+    make_renditions(stored_path, content_hash, root)
+    return content_hash, stored_path
+
+
+def ingest_files(paths, root=MEDIA_ROOT, max_workers=None):
+    if len(paths) <= 1:
+        return [ingest_file(path, root) for path in paths]
+
+    # spawn, а не fork: родительский процесс многопоточный (Qt, пул запросов)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+        return list(pool.map(ingest_file, paths, [root] * len(paths)))
+
+
+# выполняется в фоне через DataLoader: файлы в хранилище, ссылки на них в news_images
+def store_news_images(session, news_id, paths, root=MEDIA_ROOT):
+    stored = ingest_files(paths, root)
+
+    known_hashes = {
+        content_hash for (content_hash,) in
+        session.query(NewsImage.content_hash).filter(NewsImage.news_id == news_id)
+    }
+    for content_hash, stored_path in stored:
+        if content_hash in known_hashes:
+            continue
+        known_hashes.add(content_hash)
+        session.add(NewsImage(news_id=news_id, image_path=stored_path, content_hash=content_hash))
+    session.commit()
+    return news_id
+
+
+# что показывать в карусели: готовое превью, а для старых записей - исходный файл
+def display_path(image, root=MEDIA_ROOT):
+    if image.content_hash:
+        preview = rendition_path(image.content_hash, 'preview', root)
+        if os.path.exists(preview):
+            return preview
+    return image.image_path
+
+
+def collect_garbage(referenced_hashes, root=MEDIA_ROOT, grace_seconds=GC_GRACE_SECONDS):
+    removed = 0
+    now = time.time()
+    for folder in ['originals', *RENDITIONS]:
+        for dirpath, _, filenames in os.walk(os.path.join(root, folder)):
+            for filename in filenames:
+                content_hash = os.path.splitext(filename)[0]
+                if content_hash in referenced_hashes:
+                    continue
+                full_path = os.path.join(dirpath, filename)
+                if now - os.path.getmtime(full_path) < grace_seconds:
+                    continue
+                os.remove(full_path)
+                removed += 1
+    return removed
+
+
+# удаляет из хранилища файлы, на которые больше не ссылается ни одна картинка новости
+def collect_unused_media(session, root=MEDIA_ROOT, grace_seconds=GC_GRACE_SECONDS):
+    referenced_hashes = {
+        content_hash for (content_hash,) in
+        session.query(NewsImage.content_hash).filter(NewsImage.content_hash.isnot(None)).distinct()
+    }
+    return collect_garbage(referenced_hashes, root, grace_seconds)
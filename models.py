@@ -1,7 +1,28 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import (
+    create_engine, Column, Integer, String, DateTime, Boolean, ForeignKey, Index, tuple_, func, select, update, inspect,
+    text, event, bindparam, exists,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.sql import table, column, literal_column
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from datetime import datetime
+from sqlalchemy.orm import sessionmaker, relationship, deferred
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import re
+import threading
+
+NEWS_PAGE_SIZE = 50
+SNIPPET_LENGTH = 300
+# сколько последних записей держит журнал изменений; отставший сильнее клиент перечитывает ленту целиком
+NEWS_CHANGES_KEEP = 10000
+NEWS_CHANGES_LIMIT = 500
+# окна сортировки "популярное": сколько последних часов просмотров учитывается
+TRENDING_WINDOWS = {'24h': 24, '7d': 7 * 24}
+# почасовые корзины просмотров старше суток сливаются в суточные, старше недели (с запасом) удаляются
+ROLLUP_HOURLY_HOURS = 24
+ROLLUP_KEEP_HOURS = 8 * 24
+# массовая загрузка обновляет свою отметку каждой пачкой; отметка старше этого оставлена упавшим импортом
+BULK_IMPORT_STALE_SECONDS = 60
 
 Base = declarative_base()
 
@@ -22,13 +43,27 @@ class User(Base):
 
 class GameNews(Base):
     __tablename__ = 'game_news'
+    # индексы под фильтры ленты и сортировку по (date_posted, id)
+    __table_args__ = (
+        Index('ix_game_news_date', 'date_posted', 'id'),
+        Index('ix_game_news_category_date', 'category', 'date_posted', 'id'),
+        Index('ix_game_news_game_date', 'game', 'date_posted', 'id'),
+        Index('ix_game_news_category_game_date', 'category', 'game', 'date_posted', 'id'),
+        # покрывающий индекс для статистики: COUNT и SUM(view_count) по играм без чтения текста новостей
+        Index('ix_game_news_game_views', 'game', 'view_count'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     title = Column(String, nullable=False)
-    content = Column(String, nullable=False)
+    # начало текста для ленты; заполняется триггерами, лента не читает content целиком
+    snippet = Column(String, nullable=True)
+    # полный текст грузится только при обращении (детальный просмотр)
+    content = deferred(Column(String, nullable=False))
     date_posted = Column(DateTime, default=datetime.utcnow)
     category = Column(String, nullable=False)
     game = Column(String, nullable=True)
+    # счетчик уникальных просмотров, обновляется в record_views
+    view_count = Column(Integer, nullable=False, default=0, server_default='0')
 
     author_id = Column(Integer, ForeignKey('users.id'))
     author = relationship('User', backref='news')
@@ -39,16 +74,27 @@ class GameNews(Base):
 
 class NewsImage(Base):
     __tablename__ = 'news_images'
+    __table_args__ = (
+        Index('ix_news_images_news', 'news_id'),
+        Index('ix_news_images_hash', 'content_hash'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     news_id = Column(Integer, ForeignKey('game_news.id'))
     image_path = Column(String, nullable=False)
+    # sha256 файла в хранилище media_store; у старых записей пусто, там image_path на исходный файл
+    content_hash = Column(String, nullable=True)
 
     news = relationship('GameNews', back_populates='images')
 
 
 class NewsView(Base):
     __tablename__ = 'news_views'
+    __table_args__ = (
+        Index('ux_news_views_user_news', 'user_id', 'news_id', unique=True),
+        Index('ix_news_views_news', 'news_id'),
+        Index('ix_news_views_date', 'view_date'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'))
@@ -59,11 +105,824 @@ class NewsView(Base):
     user = relationship('User', backref='views')
 
 
-def init_db():
-    engine = create_engine('sqlite:///users.db')
-    Base.metadata.create_all(engine)
+# просмотры новостей по часам (hour - номер часа от 1970-01-01 UTC) для сортировки "популярное";
+# старые часы сжаты в суточные корзины с hour, кратным 24. Ключ начинается с hour, поэтому окно
+# за последние сутки или неделю - это один диапазон, сколько бы просмотров ни накопилось за все время
+class NewsViewRollup(Base):
+    __tablename__ = 'news_view_rollups'
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    hour = Column(Integer, primary_key=True)
+    news_id = Column(Integer, primary_key=True)
+    views = Column(Integer, nullable=False, default=0)
+
+
+# журнал изменений новостей для других клиентов, пишется триггерами на game_news;
+# kind: insert, update, delete или reload (массовая загрузка, news_id пустой)
+class NewsChange(Base):
+    __tablename__ = 'news_changes'
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    news_id = Column(Integer, nullable=True)
+    kind = Column(String, nullable=False)
+
+
+# число новостей по парам (категория, игра) для счетчиков на фильтрах ленты; ведется триггерами на game_news,
+# новость без игры хранится с game = ''
+class NewsFacet(Base):
+    __tablename__ = 'news_facets'
+
+    category = Column(String, primary_key=True)
+    game = Column(String, primary_key=True, server_default='')
+    count = Column(Integer, nullable=False, server_default='0')
+
+
+# сколько новостей каждой пары (категория, игра) пользователь уже открывал - для значков непрочитанного;
+# растет в record_views, при удалении новости и смене ее категории или игры правится триггерами
+class NewsReadFacet(Base):
+    __tablename__ = 'news_read_facets'
+
+    user_id = Column(Integer, primary_key=True)
+    category = Column(String, primary_key=True)
+    game = Column(String, primary_key=True, server_default='')
+    count = Column(Integer, nullable=False, server_default='0')
+
+
+# незаконченная массовая загрузка (не больше одной строки): появляется с первой пачкой и удаляется
+# finish_bulk_import, когда FTS, счетчики, индексы и триггеры восстановлены. news_start_id - max(id) новостей
+# до загрузки, если с game_news сняты триггеры вставки и индексы ленты
+class BulkImport(Base):
+    __tablename__ = 'bulk_imports'
+
+    id = Column(Integer, primary_key=True)
+    news_start_id = Column(Integer, nullable=True)
+    news_rewritten = Column(Boolean, nullable=False, default=False)
+    views_imported = Column(Boolean, nullable=False, default=False)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+# полнотекстовый индекс FTS5 по заголовку и тексту, создается миграцией, а не create_all
+news_fts = table('game_news_fts', column('rowid'), column('game_news_fts'))
+
+
+DEFAULT_DB_URL = 'sqlite:///users.db'
+# WAL: читатели не ждут писателя; synchronous=NORMAL в WAL не теряет целостность, только последний коммит при сбое питания
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA busy_timeout=10000",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-32000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+]
+
+engines = {}
+session_factories = {}
+engines_lock = threading.Lock()
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def init_db(db_url=DEFAULT_DB_URL):
+    engine = create_engine(db_url, connect_args={'timeout': 10})
+    event.listen(engine, 'connect', set_sqlite_pragmas)
+    migrate(engine)
     return engine
 
-def get_session(engine):
-    Session = sessionmaker(bind=engine)
+
+# один движок на базу на весь процесс: схема проверяется один раз, пул соединений общий для всех окон
+def get_engine(db_url=DEFAULT_DB_URL):
+    with engines_lock:
+        if db_url not in engines:
+            engines[db_url] = init_db(db_url)
+        return engines[db_url]
+
+# миграции схемы по порядку; номер последней примененной хранится в PRAGMA user_version
+def migration_view_counts(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('game_news')}
+    if 'view_count' not in columns:
+        conn.execute(text("ALTER TABLE game_news ADD COLUMN view_count INTEGER NOT NULL DEFAULT 0"))
+    # повторные просмотры мешают уникальному индексу
+    conn.execute(text(
+        "DELETE FROM news_views WHERE id NOT IN "
+        "(SELECT MIN(id) FROM news_views GROUP BY user_id, news_id)"
+    ))
+    create_indexes(conn, 'ux_news_views_user_news')
+    rebuild_view_counts(conn)
+
+
+# индексы создаются по имени из описания моделей; список в миграции фиксирован навсегда
+def create_indexes(conn, *names):
+    indexes = {index.name: index for model_table in Base.metadata.sorted_tables for index in model_table.indexes}
+    for name in names:
+        indexes[name].create(conn, checkfirst=True)
+
+
+def migration_indexes(conn):
+    create_indexes(
+        conn,
+        'ix_game_news_date',
+        'ix_game_news_category_date',
+        'ix_game_news_game_date',
+        'ix_game_news_category_game_date',
+        'ix_news_images_news',
+        'ix_news_views_news',
+    )
+
+
+FTS_INSERT_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS game_news_fts_insert AFTER INSERT ON game_news BEGIN "
+    "INSERT INTO game_news_fts(rowid, title, content) VALUES (new.id, new.title, new.content); "
+    "END"
+)
+
+
+FTS_DELETE_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS game_news_fts_delete AFTER DELETE ON game_news BEGIN "
+    "INSERT INTO game_news_fts(game_news_fts, rowid, title, content) "
+    "VALUES ('delete', old.id, old.title, old.content); "
+    "END"
+)
+
+
+FTS_UPDATE_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS game_news_fts_update AFTER UPDATE OF title, content ON game_news BEGIN "
+    "INSERT INTO game_news_fts(game_news_fts, rowid, title, content) "
+    "VALUES ('delete', old.id, old.title, old.content); "
+    "INSERT INTO game_news_fts(rowid, title, content) VALUES (new.id, new.title, new.content); "
+    "END"
+)
+
+
+# индекс синхронизируется триггерами, поэтому save_news и save_changes ничего делать не должны
+def migration_news_fts(conn):
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS game_news_fts USING fts5("
+        "title, content, content='game_news', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    ))
+    conn.execute(text(FTS_INSERT_TRIGGER))
+    conn.execute(text(FTS_DELETE_TRIGGER))
+    conn.execute(text(FTS_UPDATE_TRIGGER))
+    conn.execute(text("INSERT INTO game_news_fts(game_news_fts) VALUES ('rebuild')"))
+
+
+def migration_image_hashes(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('news_images')}
+    if 'content_hash' not in columns:
+        conn.execute(text("ALTER TABLE news_images ADD COLUMN content_hash VARCHAR"))
+    create_indexes(conn, 'ix_news_images_hash')
+
+
+def migration_view_date_index(conn):
+    create_indexes(conn, 'ix_news_views_date')
+
+
+def migration_game_views_index(conn):
+    create_indexes(conn, 'ix_game_news_game_views')
+
+
+NEWS_CHANGES_INSERT_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS news_changes_insert AFTER INSERT ON game_news BEGIN "
+    "INSERT INTO news_changes(news_id, kind) VALUES (new.id, 'insert'); "
+    "END"
+)
+
+
+NEWS_CHANGES_UPDATE_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS news_changes_update "
+    "AFTER UPDATE OF title, content, category, game ON game_news BEGIN "
+    "INSERT INTO news_changes(news_id, kind) VALUES (new.id, 'update'); "
+    "END"
+)
+
+
+NEWS_CHANGES_DELETE_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS news_changes_delete AFTER DELETE ON game_news BEGIN "
+    "INSERT INTO news_changes(news_id, kind) VALUES (old.id, 'delete'); "
+    "END"
+)
+
+
+NEWS_CHANGES_PRUNE_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS news_changes_prune AFTER INSERT ON news_changes BEGIN "
+    f"DELETE FROM news_changes WHERE id <= new.id - {NEWS_CHANGES_KEEP}; "
+    "END"
+)
+
+
+NEWS_CHANGES_IMAGES_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS news_changes_images_insert AFTER INSERT ON news_images BEGIN "
+    "INSERT INTO news_changes(news_id, kind) VALUES (new.news_id, 'update'); "
+    "END"
+)
+
+
+NEWS_CHANGES_IMAGES_DELETE_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS news_changes_images_delete AFTER DELETE ON news_images BEGIN "
+    "INSERT INTO news_changes(news_id, kind) VALUES (old.news_id, 'update'); "
+    "END"
+)
+
+
+# просмотры (view_count) в журнал не попадают, только то, что видно в ленте
+def migration_news_changes(conn):
+    NewsChange.__table__.create(conn, checkfirst=True)
+    conn.execute(text(NEWS_CHANGES_INSERT_TRIGGER))
+    conn.execute(text(NEWS_CHANGES_UPDATE_TRIGGER))
+    conn.execute(text(NEWS_CHANGES_DELETE_TRIGGER))
+    conn.execute(text(NEWS_CHANGES_PRUNE_TRIGGER))
+
+
+# картинки видны в открытой новости, поэтому их добавление и удаление тоже попадают в журнал
+def migration_image_changes(conn):
+    conn.execute(text(NEWS_CHANGES_IMAGES_TRIGGER))
+    conn.execute(text(NEWS_CHANGES_IMAGES_DELETE_TRIGGER))
+
+
+SNIPPET_INSERT_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS game_news_snippet_insert AFTER INSERT ON game_news "
+    "WHEN new.snippet IS NULL BEGIN "
+    f"UPDATE game_news SET snippet = substr(new.content, 1, {SNIPPET_LENGTH}) WHERE id = new.id; "
+    "END"
+)
+
+
+SNIPPET_UPDATE_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS game_news_snippet_update AFTER UPDATE OF content ON game_news BEGIN "
+    f"UPDATE game_news SET snippet = substr(new.content, 1, {SNIPPET_LENGTH}) WHERE id = new.id; "
+    "END"
+)
+
+
+# снипеты считает база: и это приложение, и старые клиенты, и ручные правки получают их одинаково
+def migration_news_snippets(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('game_news')}
+    if 'snippet' not in columns:
+        conn.execute(text("ALTER TABLE game_news ADD COLUMN snippet VARCHAR"))
+    conn.execute(text(SNIPPET_INSERT_TRIGGER))
+    conn.execute(text(SNIPPET_UPDATE_TRIGGER))
+    conn.execute(text(f"UPDATE game_news SET snippet = substr(content, 1, {SNIPPET_LENGTH}) WHERE snippet IS NULL"))
+
+
+NEWS_FACETS_INSERT_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS news_facets_insert AFTER INSERT ON game_news BEGIN "
+    "INSERT INTO news_facets(category, game, count) VALUES (new.category, coalesce(new.game, ''), 1) "
+    "ON CONFLICT(category, game) DO UPDATE SET count = count + 1; "
+    "END"
+)
+
+
+NEWS_FACETS_DELETE_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS news_facets_delete AFTER DELETE ON game_news BEGIN "
+    "UPDATE news_facets SET count = count - 1 WHERE category = old.category AND game = coalesce(old.game, ''); "
+    "DELETE FROM news_facets WHERE count <= 0; "
+    "END"
+)
+
+
+NEWS_FACETS_UPDATE_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS news_facets_update AFTER UPDATE OF category, game ON game_news "
+    "WHEN old.category IS NOT new.category OR old.game IS NOT new.game BEGIN "
+    "UPDATE news_facets SET count = count - 1 WHERE category = old.category AND game = coalesce(old.game, ''); "
+    "DELETE FROM news_facets WHERE count <= 0; "
+    "INSERT INTO news_facets(category, game, count) VALUES (new.category, coalesce(new.game, ''), 1) "
+    "ON CONFLICT(category, game) DO UPDATE SET count = count + 1; "
+    "END"
+)
+
+
+# новости с id больше after_id добавляются к счетчикам одним GROUP BY (пересчет и массовая загрузка)
+def add_news_facets(conn, after_id=0):
+    conn.execute(
+        text(
+            "INSERT INTO news_facets(category, game, count) "
+            "SELECT category, coalesce(game, ''), count(*) FROM game_news WHERE id > :after_id "
+            "GROUP BY category, coalesce(game, '') "
+            "ON CONFLICT(category, game) DO UPDATE SET count = count + excluded.count"
+        ),
+        {'after_id': after_id},
+    )
+
+
+# счетчики правятся на каждую вставку, удаление и смену категории или игры, поэтому фильтры
+# не пересчитывают всю таблицу новостей; пустые пары удаляются
+def migration_news_facets(conn):
+    NewsFacet.__table__.create(conn, checkfirst=True)
+    conn.execute(text(NEWS_FACETS_INSERT_TRIGGER))
+    conn.execute(text(NEWS_FACETS_DELETE_TRIGGER))
+    conn.execute(text(NEWS_FACETS_UPDATE_TRIGGER))
+    conn.execute(text("DELETE FROM news_facets"))
+    add_news_facets(conn)
+
+
+# счетчики прочитанного заново по news_views (миграция, массовая загрузка, rebuild-view-counts)
+def rebuild_read_facets(conn):
+    conn.execute(text("DELETE FROM news_read_facets"))
+    conn.execute(text(
+        "INSERT INTO news_read_facets(user_id, category, game, count) "
+        "SELECT news_views.user_id, game_news.category, coalesce(game_news.game, ''), count(*) "
+        "FROM news_views JOIN game_news ON game_news.id = news_views.news_id "
+        "GROUP BY news_views.user_id, game_news.category, coalesce(game_news.game, '')"
+    ))
+
+
+READ_FACETS_DELETE_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS news_read_facets_delete AFTER DELETE ON game_news BEGIN "
+    "UPDATE news_read_facets SET count = count - 1 "
+    "WHERE category = old.category AND game = coalesce(old.game, '') "
+    "AND user_id IN (SELECT user_id FROM news_views WHERE news_id = old.id); "
+    "DELETE FROM news_read_facets WHERE count <= 0; "
+    "END"
+)
+
+
+READ_FACETS_UPDATE_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS news_read_facets_update AFTER UPDATE OF category, game ON game_news "
+    "WHEN old.category IS NOT new.category OR old.game IS NOT new.game BEGIN "
+    "UPDATE news_read_facets SET count = count - 1 "
+    "WHERE category = old.category AND game = coalesce(old.game, '') "
+    "AND user_id IN (SELECT user_id FROM news_views WHERE news_id = new.id); "
+    "DELETE FROM news_read_facets WHERE count <= 0; "
+    "INSERT INTO news_read_facets(user_id, category, game, count) "
+    "SELECT user_id, new.category, coalesce(new.game, ''), 1 FROM news_views WHERE news_id = new.id "
+    "ON CONFLICT(user_id, category, game) DO UPDATE SET count = count + 1; "
+    "END"
+)
+
+
+# ORM удаляет просмотры раньше самой новости: тогда счетчик правится здесь, а триггер на game_news
+# уже не находит читателей, так что одна и та же новость не вычитается дважды
+READ_FACETS_VIEW_DELETE_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS news_read_facets_view_delete AFTER DELETE ON news_views BEGIN "
+    "UPDATE news_read_facets SET count = count - 1 WHERE user_id = old.user_id "
+    "AND (category, game) IN (SELECT category, coalesce(game, '') FROM game_news WHERE id = old.news_id); "
+    "DELETE FROM news_read_facets WHERE count <= 0; "
+    "END"
+)
+
+
+# новость удалили или перенесли в другую пару: у всех, кто ее открывал, счетчик переезжает вместе с ней
+def migration_read_facets(conn):
+    NewsReadFacet.__table__.create(conn, checkfirst=True)
+    conn.execute(text(READ_FACETS_DELETE_TRIGGER))
+    conn.execute(text(READ_FACETS_UPDATE_TRIGGER))
+    conn.execute(text(READ_FACETS_VIEW_DELETE_TRIGGER))
+    rebuild_read_facets(conn)
+
+
+def view_hour(moment):
+    return int(moment.replace(tzinfo=timezone.utc).timestamp()) // 3600
+
+
+# сливает почасовые корзины старше суток в суточные и удаляет то, что старше ROLLUP_KEEP_HOURS;
+# граница берется по началу суток, чтобы не слить неполный день
+def compact_view_rollups(conn, now=None):
+    current = view_hour(now or datetime.utcnow())
+    cutoff = current - ROLLUP_HOURLY_HOURS
+    cutoff -= cutoff % 24
+    conn.execute(
+        text(
+            "INSERT INTO news_view_rollups(hour, news_id, views) "
+            "SELECT hour - hour % 24, news_id, sum(views) FROM news_view_rollups "
+            "WHERE hour < :cutoff AND hour % 24 != 0 GROUP BY hour - hour % 24, news_id "
+            "ON CONFLICT(hour, news_id) DO UPDATE SET views = views + excluded.views"
+        ),
+        {'cutoff': cutoff},
+    )
+    conn.execute(text("DELETE FROM news_view_rollups WHERE hour < :cutoff AND hour % 24 != 0"), {'cutoff': cutoff})
+    conn.execute(
+        text("DELETE FROM news_view_rollups WHERE hour < :keep_from"), {'keep_from': current - ROLLUP_KEEP_HOURS}
+    )
+
+
+# корзины заново по news_views за последние ROLLUP_KEEP_HOURS (миграция и массовая загрузка)
+def rebuild_view_rollups(conn, now=None):
+    now = now or datetime.utcnow()
+    since = datetime.fromtimestamp((view_hour(now) - ROLLUP_KEEP_HOURS) * 3600, timezone.utc).replace(tzinfo=None)
+    conn.execute(text("DELETE FROM news_view_rollups"))
+    conn.execute(
+        text(
+            "INSERT INTO news_view_rollups(hour, news_id, views) "
+            "SELECT CAST(strftime('%s', view_date) AS INTEGER) / 3600 AS view_hour, news_id, count(*) "
+            "FROM news_views WHERE view_date >= :since GROUP BY view_hour, news_id"
+        ),
+        {'since': since},
+    )
+    compact_view_rollups(conn, now)
+
+
+VIEW_ROLLUPS_DELETE_TRIGGER = (
+    "CREATE TRIGGER IF NOT EXISTS news_view_rollups_delete AFTER DELETE ON game_news BEGIN "
+    "DELETE FROM news_view_rollups WHERE news_id = old.id; "
+    "END"
+)
+
+
+# удаленная новость уходит и из корзин, иначе страница популярного без фильтров выйдет короче
+def migration_view_rollups(conn):
+    NewsViewRollup.__table__.create(conn, checkfirst=True)
+    conn.execute(text(VIEW_ROLLUPS_DELETE_TRIGGER))
+    rebuild_view_rollups(conn)
+
+
+def migration_bulk_imports(conn):
+    BulkImport.__table__.create(conn, checkfirst=True)
+
+
+# каждая миграция должна спокойно выполняться и на уже актуальной схеме
+MIGRATIONS = [
+    migration_view_counts,
+    migration_indexes,
+    migration_news_fts,
+    migration_image_hashes,
+    migration_view_date_index,
+    migration_game_views_index,
+    migration_news_changes,
+    migration_image_changes,
+    migration_news_snippets,
+    migration_news_facets,
+    migration_view_rollups,
+    migration_read_facets,
+    migration_bulk_imports,
+]
+
+# все триггеры схемы: migrate создает недостающие при каждом запуске
+TRIGGERS = [
+    FTS_INSERT_TRIGGER,
+    FTS_DELETE_TRIGGER,
+    FTS_UPDATE_TRIGGER,
+    NEWS_CHANGES_INSERT_TRIGGER,
+    NEWS_CHANGES_UPDATE_TRIGGER,
+    NEWS_CHANGES_DELETE_TRIGGER,
+    NEWS_CHANGES_PRUNE_TRIGGER,
+    NEWS_CHANGES_IMAGES_TRIGGER,
+    NEWS_CHANGES_IMAGES_DELETE_TRIGGER,
+    SNIPPET_INSERT_TRIGGER,
+    SNIPPET_UPDATE_TRIGGER,
+    NEWS_FACETS_INSERT_TRIGGER,
+    NEWS_FACETS_DELETE_TRIGGER,
+    NEWS_FACETS_UPDATE_TRIGGER,
+    VIEW_ROLLUPS_DELETE_TRIGGER,
+    READ_FACETS_DELETE_TRIGGER,
+    READ_FACETS_UPDATE_TRIGGER,
+    READ_FACETS_VIEW_DELETE_TRIGGER,
+]
+# триггеры на вставку в game_news, которые массовая загрузка снимает до finish_bulk_import
+BULK_IMPORT_TRIGGERS = ['game_news_fts_insert', 'news_changes_insert', 'news_facets_insert']
+
+
+def restore_schema(conn):
+    for trigger in TRIGGERS:
+        conn.execute(text(trigger))
+    create_indexes(conn, *(index.name for model_table in Base.metadata.sorted_tables for index in model_table.indexes))
+
+
+# отметка о загрузке пишется в той же транзакции, что и пачка; поля-флаги только включаются
+def touch_bulk_import(conn, news_start_id=None, news_rewritten=False, views_imported=False):
+    conn.execute(
+        sqlite_insert(BulkImport)
+        .values(
+            id=1, news_start_id=news_start_id, news_rewritten=news_rewritten, views_imported=views_imported,
+            updated_at=datetime.utcnow(),
+        )
+        .on_conflict_do_update(
+            index_elements=['id'],
+            set_={
+                'news_start_id': func.coalesce(BulkImport.news_start_id, news_start_id),
+                'news_rewritten': BulkImport.news_rewritten | news_rewritten,
+                'views_imported': BulkImport.views_imported | views_imported,
+                'updated_at': datetime.utcnow(),
+            },
+        )
+    )
+
+
+def get_bulk_import(conn):
+    return conn.execute(select(BulkImport.__table__)).first()
+
+
+# все, что загрузка успела закоммитить, попадает в FTS и счетчики, индексы и триггеры возвращаются;
+# вызывается в конце импорта и при запуске, если импорт упал
+def finish_bulk_import(conn):
+    state = get_bulk_import(conn)
+    if state is None:
+        return
+    if state.news_start_id is not None:
+        # новости с id ниже прежнего максимума: индекс и счетчики проще собрать заново целиком
+        after_id = 0 if state.news_rewritten else state.news_start_id
+        if state.news_rewritten:
+            conn.execute(text("INSERT INTO game_news_fts(game_news_fts) VALUES ('rebuild')"))
+            conn.execute(text("DELETE FROM news_facets"))
+        else:
+            conn.execute(
+                text(
+                    "INSERT INTO game_news_fts(rowid, title, content) "
+                    "SELECT id, title, content FROM game_news WHERE id > :after_id"
+                ),
+                {'after_id': after_id},
+            )
+        add_news_facets(conn, after_id)
+        create_indexes(conn, *(index.name for index in GameNews.__table__.indexes))
+        conn.execute(NewsChange.__table__.insert(), {'news_id': None, 'kind': 'reload'})
+        for trigger in (FTS_INSERT_TRIGGER, NEWS_FACETS_INSERT_TRIGGER, NEWS_CHANGES_INSERT_TRIGGER):
+            conn.execute(text(trigger))
+    if state.views_imported:
+        rebuild_view_counts(conn)
+        rebuild_view_rollups(conn)
+        rebuild_read_facets(conn)
+    conn.execute(BulkImport.__table__.delete())
+
+
+# отметка, которую давно не обновляли, осталась от упавшего импорта - он доводится при запуске;
+# свежая значит, что загрузка идет в другом процессе, и снятые ей триггеры возвращать рано.
+# Триггеры вставки, снятые без отметки (загрузка до появления bulk_imports), - поиск и счетчики собираются целиком
+def recover_bulk_import(conn):
+    state = get_bulk_import(conn)
+    if state is None:
+        triggers = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).scalars())
+        if triggers.issuperset(BULK_IMPORT_TRIGGERS):
+            return True
+        touch_bulk_import(conn, news_start_id=0, news_rewritten=True)
+    elif datetime.utcnow() - state.updated_at < timedelta(seconds=BULK_IMPORT_STALE_SECONDS):
+        return False
+    finish_bulk_import(conn)
+    return True
+
+
+def migrate(engine):
+    with engine.begin() as conn:
+        version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+        # новая база: таблицы из моделей, остальное (FTS, триггеры) добавят миграции
+        if not inspect(conn).has_table('users'):
+            Base.metadata.create_all(conn)
+            version = 0
+
+        for migration in MIGRATIONS[version:]:
+            migration(conn)
+
+        conn.exec_driver_sql(f"PRAGMA user_version = {len(MIGRATIONS)}")
+
+        # триггеры и индексы могли пропасть (сбой массовой загрузки, ручные правки) - создаются заново
+        if recover_bulk_import(conn):
+            restore_schema(conn)
+
+def get_session(engine=None):
+    engine = engine or get_engine()
+    with engines_lock:
+        if engine not in session_factories:
+            session_factories[engine] = sessionmaker(bind=engine)
+        Session = session_factories[engine]
     return Session()
+
+
+# автор и число просмотров одним запросом вместо отдельного запроса на каждую новость
+def news_summary_query(session, *entities):
+    return (
+        session.query(
+            *entities,
+            User.username.label('author_name'),
+            GameNews.view_count.label('views_count'),
+        )
+        .select_from(GameNews)
+        .outerjoin(User, User.id == GameNews.author_id)
+    )
+
+
+# новости, которых пользователь еще не открывал: NOT EXISTS - один поиск по уникальному индексу
+# (user_id, news_id) на строку, страница ленты проверяет только свои строки.
+# pending_views - открытые, но еще не записанные ViewRecorder новости
+def filter_unread(query, user_id, pending_views=()):
+    query = query.filter(~exists().where(NewsView.user_id == user_id, NewsView.news_id == GameNews.id))
+    if pending_views:
+        query = query.filter(GameNews.id.notin_(pending_views))
+    return query
+
+
+def news_feed_query(session, category=None, game=None, unread_for=None, pending_views=()):
+    query = news_summary_query(
+        session,
+        GameNews.id,
+        GameNews.title,
+        GameNews.snippet,
+        GameNews.category,
+        GameNews.game,
+        GameNews.date_posted,
+    )
+
+    if category:
+        query = query.filter(GameNews.category == category)
+
+    if game:
+        query = query.filter(GameNews.game == game)
+
+    if unread_for is not None:
+        query = filter_unread(query, unread_for, pending_views)
+
+    return query
+
+
+# изменения после отметки after_id: (последний id журнала, [(news_id, kind)], нужно ли перечитать все);
+# по каждой новости остается только последнее изменение
+def get_news_changes(session, after_id=None, limit=NEWS_CHANGES_LIMIT):
+    first_id, last_id = session.query(
+        func.coalesce(func.min(NewsChange.id), 0), func.coalesce(func.max(NewsChange.id), 0)
+    ).one()
+    if after_id is None or after_id == last_id:
+        return last_id, [], False
+    # журнал обрезан или база подменена: по журналу уже не догнать
+    if after_id > last_id or after_id + 1 < first_id or last_id - after_id > limit:
+        return last_id, [], True
+
+    rows = session.query(NewsChange.news_id, NewsChange.kind).filter(NewsChange.id > after_id).order_by(NewsChange.id)
+    changes = {}
+    for news_id, kind in rows:
+        if kind == 'reload':
+            return last_id, [], True
+        changes.pop(news_id, None)
+        changes[news_id] = kind
+    return last_id, list(changes.items()), False
+
+
+# то же, что делают триггеры; массовая загрузка считает снипеты сама, чтобы не обновлять каждую строку
+def make_snippet(content):
+    return content[:SNIPPET_LENGTH]
+
+
+# одна строка ленты (те же колонки, что в get_news_page) или None
+# с unread_for прочитанная этим пользователем новость не возвращается, как и в ленте непрочитанного
+def get_feed_item(session, news_id, unread_for=None, pending_views=()):
+    return news_feed_query(session, unread_for=unread_for, pending_views=pending_views).filter(
+        GameNews.id == news_id
+    ).first()
+
+
+# страница ленты по ключу (date_posted, id): без OFFSET и без загрузки всей таблицы
+def get_news_page(session, category=None, game=None, after=None, limit=NEWS_PAGE_SIZE, unread_for=None,
+                  pending_views=()):
+    query = news_feed_query(session, category, game, unread_for, pending_views)
+
+    if after is not None:
+        query = query.filter(tuple_(GameNews.date_posted, GameNews.id) < tuple_(after.date_posted, after.id))
+
+    return query.order_by(GameNews.date_posted.desc(), GameNews.id.desc()).limit(limit).all()
+
+
+# каждое слово ищется как префикс: "обнов" найдет "обновление"
+def make_fts_query(search_text):
+    words = re.findall(r'\w+', search_text)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+# поиск по FTS5, лучшие совпадения первыми (совпадение в заголовке весит больше)
+def search_news(session, search_text, category=None, game=None, offset=0, limit=NEWS_PAGE_SIZE, unread_for=None,
+                pending_views=()):
+    fts_query = make_fts_query(search_text)
+    if not fts_query:
+        return []
+
+    rank = func.bm25(literal_column('game_news_fts'), 10.0, 1.0)
+    query = (
+        news_feed_query(session, category, game, unread_for, pending_views)
+        .join(news_fts, news_fts.c.rowid == GameNews.id)
+        .filter(news_fts.c.game_news_fts.op('MATCH')(fts_query))
+        .order_by(rank, GameNews.date_posted.desc(), GameNews.id.desc())
+    )
+    return query.offset(offset).limit(limit).all()
+
+
+# "популярное": новости с просмотрами за окно (24h или 7d) по убыванию их числа, при равенстве новее выше;
+# страницы по offset. Суммируются только корзины окна, поэтому цена не зависит от длины всей истории просмотров.
+# Без фильтров страница выбирается прямо из сумм, и с game_news соединяются только ее строки
+def get_trending_page(session, window, category=None, game=None, offset=0, limit=NEWS_PAGE_SIZE, unread_for=None,
+                      pending_views=(), now=None):
+    since = view_hour(now or datetime.utcnow()) - TRENDING_WINDOWS[window]
+    score = func.sum(NewsViewRollup.views).label('score')
+    scores = (
+        select(NewsViewRollup.news_id, score)
+        .where(NewsViewRollup.hour > since)
+        .group_by(NewsViewRollup.news_id)
+    )
+    filtered = category is not None or game is not None or unread_for is not None
+    if not filtered:
+        scores = scores.order_by(score.desc(), NewsViewRollup.news_id.desc()).offset(offset).limit(limit)
+        offset = 0
+    scores = scores.subquery()
+    query = (
+        news_feed_query(session, category, game, unread_for, pending_views)
+        .join(scores, scores.c.news_id == GameNews.id)
+        .order_by(scores.c.score.desc(), scores.c.news_id.desc())
+    )
+    return query.offset(offset).limit(limit).all()
+
+
+# то, что в новости меняется постоянно: (views_count, viewed), viewed - открывал ли ее уже viewer_id
+def get_news_views(session, news_id, viewer_id=None):
+    viewed = (
+        select(NewsView.id)
+        .where(NewsView.news_id == GameNews.id, NewsView.user_id == viewer_id)
+        .exists()
+        .label('viewed')
+    )
+    return (
+        session.query(GameNews.view_count.label('views_count'), viewed)
+        .filter(GameNews.id == news_id)
+        .one()
+    )
+
+
+# число новостей по парам (категория, игра): [(category, game, count)] из news_facets, без обхода game_news
+def count_news(session):
+    rows = session.query(NewsFacet.category, NewsFacet.game, NewsFacet.count).filter(NewsFacet.count > 0)
+    return [(category, game or None, count) for category, game, count in rows]
+
+
+# непрочитанные по парам (категория, игра) = все новости минус открытые. Оба слагаемых - готовые счетчики
+# (news_facets и news_read_facets по префиксу user_id), цена не зависит от истории просмотров пользователя
+def count_unread(session, user_id, pending_views=()):
+    counts = Counter({(category, game): count for category, game, count in count_news(session)})
+    read = session.query(NewsReadFacet.category, NewsReadFacet.game, NewsReadFacet.count).filter(
+        NewsReadFacet.user_id == user_id
+    )
+    counts.subtract({(category, game or None): count for category, game, count in read})
+    if pending_views:
+        pending = filter_unread(session.query(GameNews.category, GameNews.game), user_id)
+        counts.subtract(pending.filter(GameNews.id.in_(pending_views)).all())
+    return [(category, game, count) for (category, game), count in counts.items() if count > 0]
+
+
+def get_news_images(session, news_id):
+    return session.query(NewsImage).filter_by(news_id=news_id).order_by(NewsImage.id).all()
+
+
+def find_user(session, username, password):
+    return session.query(User).filter_by(username=username, password=password).first()
+
+
+# пачка просмотров [{'user_id', 'news_id', 'view_date'}] одной транзакцией;
+# повторные просмотры отбрасываются, счетчики растут только на действительно новые
+def record_views(session, views):
+    if not views:
+        return 0
+    inserted = session.execute(
+        sqlite_insert(NewsView)
+        .values(views)
+        .on_conflict_do_nothing(index_elements=['user_id', 'news_id'])
+        .returning(NewsView.user_id, NewsView.news_id, NewsView.view_date)
+    ).all()
+
+    added = Counter(news_id for user_id, news_id, view_date in inserted)
+    if added:
+        session.execute(
+            GameNews.__table__.update()
+            .where(GameNews.id == bindparam('news'))
+            .values(view_count=GameNews.view_count + bindparam('added')),
+            [{'news': news_id, 'added': count} for news_id, count in added.items()],
+        )
+        session.execute(
+            text(
+                "INSERT INTO news_read_facets(user_id, category, game, count) "
+                "SELECT :user_id, category, coalesce(game, ''), 1 FROM game_news WHERE id = :news_id "
+                "ON CONFLICT(user_id, category, game) DO UPDATE SET count = count + 1"
+            ),
+            [{'user_id': user_id, 'news_id': news_id} for user_id, news_id, view_date in inserted],
+        )
+
+    # почасовые корзины для "популярного"; просмотры старше хранимого окна туда уже не нужны
+    keep_from = view_hour(datetime.utcnow()) - ROLLUP_KEEP_HOURS
+    hours = Counter((view_hour(view_date), news_id) for user_id, news_id, view_date in inserted)
+    rollups = [
+        {'hour': hour, 'news_id': news_id, 'views': count}
+        for (hour, news_id), count in hours.items() if hour >= keep_from
+    ]
+    if rollups:
+        upsert = sqlite_insert(NewsViewRollup)
+        session.execute(
+            upsert.on_conflict_do_update(
+                index_elements=['hour', 'news_id'], set_={'views': NewsViewRollup.views + upsert.excluded.views}
+            ),
+            rollups,
+        )
+    session.commit()
+    return len(inserted)
+
+
+# пересчитывает счетчики просмотров по таблице news_views
+def rebuild_view_counts(conn):
+    counts = (
+        select(NewsView.news_id, func.count().label('views'))
+        .group_by(NewsView.news_id)
+        .subquery()
+    )
+    conn.execute(update(GameNews).values(view_count=0))
+    conn.execute(
+        update(GameNews)
+        .where(GameNews.id == counts.c.news_id)
+        .values(view_count=counts.c.views)
+    )
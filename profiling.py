@@ -0,0 +1,114 @@
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# включается переменной окружения KURSOVAY_PROFILE=1 или флагом --profile
+ENABLED = os.environ.get('KURSOVAY_PROFILE') == '1' or '--profile' in sys.argv
+TRACE_PATH = os.environ.get('KURSOVAY_PROFILE_TRACE', 'profile_trace.json')
+# в файл трассы попадают последние события, в окно - совсем свежие
+MAX_TRACE_EVENTS = 200000
+PANEL_EVENTS = 200
+SQL_PREVIEW_LENGTH = 200
+
+
+# собирает замеры SQL, обработчиков окна и фоновых задач в формате Chrome trace
+class Profiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.events = deque(maxlen=MAX_TRACE_EVENTS)
+        self.recent_events = deque(maxlen=PANEL_EVENTS)
+        self.totals = {}
+
+    def record(self, name, category, start, duration, args=None):
+        trace_event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start - self.started) * 1e6, 1),
+            'dur': round(duration * 1e6, 1),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args or {},
+        }
+        with self.lock:
+            self.events.append(trace_event)
+            self.recent_events.append(trace_event)
+            count, total = self.totals.get((category, name), (0, 0.0))
+            self.totals[(category, name)] = (count + 1, total + duration)
+
+    @contextmanager
+    def span(self, name, category='handler', **args):
+        if not ENABLED:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, category, start, time.perf_counter() - start, args)
+
+    def recent(self):
+        with self.lock:
+            return list(self.recent_events)
+
+    # (категория, имя, количество, суммарное время в секундах), самые дорогие первыми
+    def summary(self):
+        with self.lock:
+            rows = [(category, name, count, total) for (category, name), (count, total) in self.totals.items()]
+        return sorted(rows, key=lambda row: row[3], reverse=True)
+
+    # sqlalchemy импортируется только в режиме профилирования: окну входа он не нужен
+    def install_sql_hooks(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    # начало замера хранится в контексте выполнения: упавший запрос не сбивает замеры следующих
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._profile_started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = context._profile_started
+        statement = " ".join(statement.split())
+        self.record(
+            statement[:60], 'sql', started, time.perf_counter() - started,
+            {'statement': statement[:SQL_PREVIEW_LENGTH], 'executemany': executemany},
+        )
+
+    def write_trace(self, path=TRACE_PATH):
+        with self.lock:
+            trace_events = list(self.events)
+        with open(path, 'w', encoding='utf-8') as out:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, out, ensure_ascii=False)
+        return path
+
+
+profiler = Profiler()
+
+
+# замер обработчика; без режима профилирования функция возвращается как есть
+def profiled(name=None, category='handler'):
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profiler.span(name or fn.__qualname__, category):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+if ENABLED:
+    profiler.install_sql_hooks()
+    atexit.register(profiler.write_trace)
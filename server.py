@@ -0,0 +1,249 @@
+import asyncio
+import json
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from http import HTTPStatus
+from types import SimpleNamespace
+from urllib.parse import urlsplit, parse_qs
+
+from sqlalchemy.exc import NoResultFound
+
+from models import NEWS_PAGE_SIZE
+from services import to_json
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# потоков для запросов к базе не больше, чем соединений в пуле движка (5 + 10 сверху)
+DEFAULT_WORKERS = 8
+# страницы ленты отдаются из памяти; счетчики просмотров в них отстают не больше чем на это время
+FEED_CACHE_SECONDS = 5
+FEED_CACHE_SIZE = 512
+KEEPALIVE_SECONDS = 30
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def int_param(params, name, default=None):
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"Параметр {name} должен быть числом")
+
+
+def error_payload(error):
+    return json.dumps({'error': str(error)}, ensure_ascii=False).encode('utf-8')
+
+
+# JSON/HTTP поверх NewsService: один прогретый процесс (кэш, пул соединений) на всех клиентов
+class ApiServer:
+    def __init__(self, service, workers=DEFAULT_WORKERS):
+        self.service = service
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='api')
+        self.feed_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # (метод, путь, обработчик, что делать с кэшем ленты: 'cache', 'invalidate' или None)
+        self.routes = [
+            ('GET', r'/api/health', self.health, None),
+            ('POST', r'/api/login', self.login, None),
+            ('POST', r'/api/register', self.register, None),
+            ('GET', r'/api/news', self.feed_page, 'cache'),
+            ('POST', r'/api/news', self.add_news, 'invalidate'),
+            ('GET', r'/api/news/(\d+)', self.feed_item, None),
+            ('PUT', r'/api/news/(\d+)', self.update_news_content, 'invalidate'),
+            ('POST', r'/api/news/(\d+)/open', self.news_detail, None),
+            ('POST', r'/api/news/(\d+)/images', self.add_images, 'invalidate'),
+            ('DELETE', r'/api/images/(\d+)', self.delete_image, 'invalidate'),
+            ('POST', r'/api/media/gc', self.collect_media, None),
+            ('GET', r'/api/stats', self.statistics, None),
+            ('GET', r'/api/changes', self.news_changes, None),
+            ('GET', r'/api/facets', self.facet_counts, 'cache'),
+            ('GET', r'/api/unread', self.unread_counts, None),
+        ]
+        self.routes = [(method, re.compile(path), handler, cache) for method, path, handler, cache in self.routes]
+
+    # обработчики выполняются в потоках executor: params - строка запроса, body - JSON тела
+    def health(self, params, body):
+        return {
+            'status': 'ok', 'cache_hits': self.cache_hits, 'cache_misses': self.cache_misses,
+            'entities': self.service.cache_stats(),
+        }
+
+    def login(self, params, body):
+        return self.service.login(body['username'], body['password'])
+
+    def register(self, params, body):
+        return self.service.register(body['username'], body['password'], body.get('secret_key', ''))
+
+    def feed_page(self, params, body):
+        after = None
+        if params.get('after_date') and params.get('after_id'):
+            after = SimpleNamespace(date_posted=datetime.fromisoformat(params['after_date']),
+                                    id=int_param(params, 'after_id'))
+        return self.service.feed_page(
+            params.get('category'), params.get('game'), params.get('search', ''), after,
+            int_param(params, 'offset', 0), int_param(params, 'limit', NEWS_PAGE_SIZE), int_param(params, 'unread_for'),
+            params.get('sort'),
+        )
+
+    def add_news(self, params, body):
+        return self.service.add_news(body['user_id'], body['title'], body['content'], body['category'],
+                                     body.get('game'))
+
+    def feed_item(self, params, body, news_id):
+        return self.service.feed_item(int(news_id), int_param(params, 'unread_for'))
+
+    def update_news_content(self, params, body, news_id):
+        return self.service.update_news_content(int(news_id), body['content'])
+
+    def news_detail(self, params, body, news_id):
+        return self.service.news_detail(body['user_id'], int(news_id))
+
+    def add_images(self, params, body, news_id):
+        return self.service.add_images(int(news_id), body['paths'])
+
+    def delete_image(self, params, body, image_id):
+        return self.service.delete_image(int(image_id))
+
+    def collect_media(self, params, body):
+        return self.service.collect_media()
+
+    def statistics(self, params, body):
+        return self.service.statistics()
+
+    def news_changes(self, params, body):
+        return self.service.news_changes(int_param(params, 'after'))
+
+    def facet_counts(self, params, body):
+        return self.service.facet_counts()
+
+    def unread_counts(self, params, body):
+        return self.service.unread_counts(int_param(params, 'user_id'))
+
+    def cached(self, target):
+        entry = self.feed_cache.get(target)
+        if entry is None or time.monotonic() - entry[0] > FEED_CACHE_SECONDS:
+            self.cache_misses += 1
+            return None
+        self.feed_cache.move_to_end(target)
+        self.cache_hits += 1
+        return entry[1]
+
+    def remember(self, target, payload):
+        self.feed_cache[target] = (time.monotonic(), payload)
+        self.feed_cache.move_to_end(target)
+        while len(self.feed_cache) > FEED_CACHE_SIZE:
+            self.feed_cache.popitem(last=False)
+
+    # кэш трогается только из цикла событий, поэтому без блокировок
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        for route_method, path, handler, cache in self.routes:
+            match = path.fullmatch(url.path)
+            if match and route_method == method:
+                break
+        else:
+            raise HttpError(HTTPStatus.NOT_FOUND, f"Нет такого адреса: {method} {url.path}")
+
+        # непрочитанное у каждого пользователя свое и меняется с каждой открытой новостью
+        if cache == 'cache' and 'unread_for=' in url.query:
+            cache = None
+        if cache == 'cache':
+            payload = self.cached(target)
+            if payload is not None:
+                return HTTPStatus.OK, payload
+
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Тело запроса не является JSON")
+
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self.executor, partial(handler, params, data, *match.groups()))
+        except NoResultFound:
+            raise HttpError(HTTPStatus.NOT_FOUND, "Не найдено")
+        except (KeyError, TypeError, ValueError) as error:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"Неверный запрос: {error}")
+
+        payload = json.dumps(to_json(result), ensure_ascii=False).encode('utf-8')
+        if cache == 'cache':
+            self.remember(target, payload)
+        elif cache == 'invalidate':
+            self.feed_cache.clear()
+        return HTTPStatus.OK, payload
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_BYTES:
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                try:
+                    status, payload = await self.dispatch(method, target, body)
+                except HttpError as error:
+                    status, payload = error.status, error_payload(error)
+                except Exception as error:
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, error_payload(error)
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def run_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_WORKERS):
+    api = ApiServer(service, workers)
+    print(f"Сервер новостей слушает http://{host}:{port}")
+    try:
+        asyncio.run(api.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.executor.shutdown(wait=False)
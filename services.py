@@ -0,0 +1,551 @@
+import atexit
+import http.client
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from types import SimpleNamespace
+from urllib.parse import urlsplit, urlencode
+
+from sqlalchemy import delete
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.orm import undefer
+
+from models import (
+    User, GameNews, NewsImage, get_engine, get_session, get_news_page, get_feed_item, search_news,
+    get_news_views, get_news_images, get_news_changes, find_user, record_views, make_fts_query, count_unread,
+    count_news, get_trending_page, compact_view_rollups, view_hour, NEWS_PAGE_SIZE,
+)
+from media_store import store_news_images, collect_unused_media
+from stats import StatsService
+
+logger = logging.getLogger(__name__)
+
+# адрес сервера (python manage.py serve); если не задан, окно работает с базой напрямую
+API_URL_ENV = 'KURSOVAY_API_URL'
+ADMIN_SECRET_KEY = 'SECRET_KEY'
+DATE_FIELDS = {'date_posted', 'registration_date', 'view_date'}
+API_TIMEOUT_SECONDS = 30
+# просмотры пишутся пачкой раз в столько секунд или по набору такого количества
+VIEW_FLUSH_SECONDS = 2
+VIEW_FLUSH_SIZE = 200
+# после неудачной записи пачки следующая попытка откладывается вдвое дольше, но не больше чем на столько
+VIEW_RETRY_MAX_SECONDS = 60
+# сколько записей держат кэши пользователей, новостей и списков картинок
+USERS_CACHE_SIZE = 1000
+NEWS_CACHE_SIZE = 500
+IMAGES_CACHE_SIZE = 500
+
+
+# окну отдаются простые записи, а не объекты ORM: их одинаково можно вернуть из базы и из JSON
+def user_record(user):
+    return SimpleNamespace(id=user.id, username=user.username, role=user.role, registration_date=user.registration_date)
+
+
+def feed_record(row):
+    return SimpleNamespace(
+        id=row.id, title=row.title, snippet=row.snippet, category=row.category, game=row.game,
+        date_posted=row.date_posted, author_name=row.author_name, views_count=row.views_count,
+    )
+
+
+def image_record(image):
+    return SimpleNamespace(id=image.id, news_id=image.news_id, image_path=image.image_path,
+                           content_hash=image.content_hash)
+
+
+def article_record(news):
+    return SimpleNamespace(
+        id=news.id, title=news.title, content=news.content, category=news.category, game=news.game,
+        date_posted=news.date_posted, author_id=news.author_id,
+    )
+
+
+def to_json(value):
+    if isinstance(value, SimpleNamespace):
+        value = vars(value)
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def from_json(data):
+    if data is None:
+        return None
+    fields = {
+        key: datetime.fromisoformat(value) if key in DATE_FIELDS and value else value
+        for key, value in data.items()
+    }
+    return SimpleNamespace(**fields)
+
+
+# кэш со сквозным чтением: при промахе значение грузит load(key), старые записи вытесняются по LRU
+class EntityCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # растет при каждом сбросе: то, что грузилось во время сброса, в кэш не кладется
+        self.generation = 0
+
+    def get(self, key, load):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            generation = self.generation
+
+        value = load(key)
+        if value is not None:
+            with self.lock:
+                if generation == self.generation:
+                    self.store(key, value)
+        return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.store(key, value)
+
+    def store(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+
+# просмотры копятся в памяти и пишутся одной транзакцией: открытие новости не ждет записи на диск
+class ViewRecorder:
+    def __init__(self, engine, flush_seconds=VIEW_FLUSH_SECONDS, flush_size=VIEW_FLUSH_SIZE):
+        self.engine = engine
+        self.flush_seconds = flush_seconds
+        self.flush_size = flush_size
+        self.lock = threading.Lock()
+        # пачки пишутся по очереди, чтобы старая не легла поверх новой
+        self.flush_lock = threading.Lock()
+        self.pending = {}
+        # пачка, которая сейчас пишется: ее просмотры уже не в pending, но еще не в базе
+        self.writing = {}
+        self.timer = None
+        self.failures = 0
+        # час последнего сжатия корзин просмотров: сжимаем не чаще раза в час
+        self.compacted_hour = None
+        atexit.register(self.try_flush)
+
+    # True, если этот просмотр еще не стоял в очереди
+    def add(self, user_id, news_id):
+        with self.lock:
+            added = (user_id, news_id) not in self.pending and (user_id, news_id) not in self.writing
+            self.pending.setdefault((user_id, news_id), datetime.utcnow())
+            pending = len(self.pending)
+            # после сбоя пачку пишет только таймер с отсрочкой: открытие новости не ждет занятую базу
+            retrying = self.failures > 0
+            self.schedule(self.flush_seconds)
+        if pending >= self.flush_size and not retrying:
+            self.try_flush()
+        return added
+
+    # вызывается под self.lock; таймер уже взведен - ничего не делаем
+    def schedule(self, delay):
+        if self.timer is None:
+            self.timer = threading.Timer(delay, self.try_flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    # запись из таймера, по размеру пачки и при выходе: ошибка не уходит в чужой поток,
+    # пачка остается в очереди, а повтор уже запланирован в flush
+    def try_flush(self):
+        try:
+            return self.flush()
+        except Exception:
+            logger.exception("Не удалось записать просмотры, повтор через %s с", self.retry_delay())
+            return 0
+
+    def retry_delay(self):
+        return min(self.flush_seconds * 2 ** self.failures, VIEW_RETRY_MAX_SECONDS)
+
+    # новости, которые пользователь открыл, но в news_views их еще нет
+    def pending_news(self, user_id):
+        with self.lock:
+            return [news_id for viewer_id, news_id in [*self.pending, *self.writing] if viewer_id == user_id]
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+                self.writing = batch
+                timer, self.timer = self.timer, None
+            if timer is not None:
+                timer.cancel()
+            if not batch:
+                return 0
+
+            views = [
+                {'user_id': user_id, 'news_id': news_id, 'view_date': view_date}
+                for (user_id, news_id), view_date in batch.items()
+            ]
+            session = get_session(self.engine)
+            try:
+                recorded = record_views(session, views)
+            except Exception:
+                # база была занята или недоступна: пачка вернется в очередь, повтор - по таймеру с отсрочкой
+                with self.lock:
+                    for key, view_date in batch.items():
+                        self.pending.setdefault(key, view_date)
+                    self.failures += 1
+                    self.schedule(self.retry_delay())
+                raise
+            else:
+                self.failures = 0
+            finally:
+                with self.lock:
+                    self.writing = {}
+                session.close()
+            self.compact_rollups()
+            return recorded
+
+    # корзины растут только вместе с записью просмотров, поэтому и сжимаются здесь, раз в час,
+    # отдельной транзакцией; неудача не мешает записи пачки и повторится при следующей
+    def compact_rollups(self):
+        hour = view_hour(datetime.utcnow())
+        if self.compacted_hour == hour:
+            return
+        try:
+            with self.engine.begin() as conn:
+                compact_view_rollups(conn)
+        except Exception:
+            logger.exception("Не удалось сжать корзины просмотров")
+            return
+        self.compacted_hour = hour
+
+
+# все операции приложения без Qt: их вызывают окна (в фоновых потоках) и HTTP-сервер
+class NewsService:
+    def __init__(self, engine):
+        self.engine = engine
+        # откуда данные: по нему окно отличает свой снимок ленты от снятого с другой базы
+        self.source = engine.url.render_as_string(hide_password=True)
+        self.views = ViewRecorder(engine)
+        self.stats = StatsService(engine)
+        self.users = EntityCache(USERS_CACHE_SIZE)
+        self.articles = EntityCache(NEWS_CACHE_SIZE)
+        self.images = EntityCache(IMAGES_CACHE_SIZE)
+        self.watch_lock = threading.Lock()
+        self.watch_connection = None
+        self.changes_seen = None
+
+    @contextmanager
+    def session(self):
+        session = get_session(self.engine)
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def login(self, username, password):
+        with self.session() as session:
+            user = find_user(session, username, password)
+            if user is None:
+                return None
+            record = user_record(user)
+        self.users.put(record.id, record)
+        return record
+
+    # None, если имя уже занято
+    def register(self, username, password, secret_key=''):
+        with self.session() as session:
+            if session.query(User).filter_by(username=username).first():
+                return None
+            role = "Admin" if secret_key == ADMIN_SECRET_KEY else "Пользователь"
+            user = User(username=username, password=password, role=role)
+            session.add(user)
+            session.commit()
+            record = user_record(user)
+        self.users.put(record.id, record)
+        return record
+
+    # с текстом поиска - FTS по релевантности (offset), с sort ('24h', '7d') - популярное за окно (offset),
+    # иначе лента по дате (after); unread_for - только новости, которые этот пользователь еще не открывал
+    def feed_page(self, category=None, game=None, search_text='', after=None, offset=0, limit=NEWS_PAGE_SIZE,
+                  unread_for=None, sort=None):
+        pending = self.views.pending_news(unread_for) if unread_for is not None else ()
+        with self.session() as session:
+            if make_fts_query(search_text):
+                rows = search_news(session, search_text, category, game, offset, limit, unread_for, pending)
+            elif sort:
+                rows = get_trending_page(session, sort, category, game, offset, limit, unread_for, pending)
+            else:
+                rows = get_news_page(session, category, game, after, limit, unread_for, pending)
+            return [feed_record(row) for row in rows]
+
+    # [(category, game, count)] всех новостей: счетчики ведут триггеры базы, читается несколько строк
+    def facet_counts(self):
+        with self.session() as session:
+            return count_news(session)
+
+    # [(category, game, count)] непрочитанных новостей пользователя, из них окно считает значки фильтров
+    def unread_counts(self, user_id):
+        pending = self.views.pending_news(user_id)
+        with self.session() as session:
+            return [tuple(row) for row in count_unread(session, user_id, pending)]
+
+    # строка ленты для одной новости: ей окно правит список после изменения
+    def feed_item(self, news_id, unread_for=None):
+        pending = self.views.pending_news(unread_for) if unread_for is not None else ()
+        with self.session() as session:
+            row = get_feed_item(session, news_id, unread_for, pending)
+            return feed_record(row) if row else None
+
+    def user(self, session, user_id):
+        def load(user_id):
+            user = session.get(User, user_id)
+            return user_record(user) if user else None
+        return self.users.get(user_id, load)
+
+    def article(self, session, news_id):
+        def load(news_id):
+            return article_record(
+                session.query(GameNews).options(undefer(GameNews.content)).filter_by(id=news_id).one()
+            )
+        return self.articles.get(news_id, load)
+
+    def news_images(self, session, news_id):
+        def load(news_id):
+            return [image_record(image) for image in get_news_images(session, news_id)]
+        return self.images.get(news_id, load)
+
+    # новость с картинками; сама новость, автор и картинки берутся из кэша, из базы - только счетчик просмотров.
+    # первый просмотр ставится в очередь и сразу учитывается в показанном счетчике;
+    # first_view - новость до этого была непрочитанной
+    def news_detail(self, user_id, news_id):
+        with self.session() as session:
+            views = get_news_views(session, news_id, user_id)
+            article = self.article(session, news_id)
+            author = self.user(session, article.author_id) if article.author_id else None
+            images = self.news_images(session, news_id)
+
+        views_count = views.views_count
+        first_view = False
+        if not views.viewed:
+            first_view = self.views.add(user_id, news_id)
+            views_count += 1
+        return SimpleNamespace(
+            **vars(article), author_name=author.username if author else None, views_count=views_count,
+            images=list(images), first_view=first_view,
+        )
+
+    # data_version отдельного соединения меняется только после чужих коммитов;
+    # пока он прежний, журнал изменений не читается вовсе
+    def data_version(self):
+        with self.watch_lock:
+            if self.watch_connection is None:
+                self.watch_connection = self.engine.raw_connection()
+            cursor = self.watch_connection.cursor()
+            try:
+                cursor.execute("PRAGMA data_version")
+                return cursor.fetchone()[0]
+            finally:
+                cursor.close()
+
+    # {'last_id', 'changes': [(news_id, kind)], 'reload'}; after_id=None - только узнать текущую отметку
+    def news_changes(self, after_id=None):
+        version = self.data_version()
+        seen = self.changes_seen
+        if after_id is not None and seen is not None and seen == (version, after_id):
+            return {'last_id': after_id, 'changes': [], 'reload': False}
+
+        with self.session() as session:
+            last_id, changes, reload = get_news_changes(session, after_id)
+        # чужие изменения сбрасывают и закэшированные новости
+        if reload:
+            self.articles.clear()
+            self.images.clear()
+        for news_id, kind in changes:
+            self.articles.invalidate(news_id)
+            self.images.invalidate(news_id)
+        self.changes_seen = (version, last_id)
+        return {'last_id': last_id, 'changes': changes, 'reload': reload}
+
+    def add_news(self, user_id, title, content, category, game=None):
+        with self.session() as session:
+            news = GameNews(title=title, content=content, category=category, author_id=user_id, game=game)
+            session.add(news)
+            session.commit()
+            news_id = news.id
+        # SQLite может выдать id удаленной новости заново
+        self.articles.invalidate(news_id)
+        self.images.invalidate(news_id)
+        return news_id
+
+    def update_news_content(self, news_id, content):
+        with self.session() as session:
+            session.query(GameNews).filter_by(id=news_id).update({'content': content})
+            session.commit()
+        self.articles.invalidate(news_id)
+
+    def add_images(self, news_id, paths):
+        with self.session() as session:
+            store_news_images(session, news_id, paths)
+        self.images.invalidate(news_id)
+        return news_id
+
+    # возвращает оставшиеся картинки той же новости
+    def delete_image(self, image_id):
+        with self.session() as session:
+            news_id = session.execute(
+                delete(NewsImage).where(NewsImage.id == image_id).returning(NewsImage.news_id)
+            ).scalar()
+            session.commit()
+            if news_id is None:
+                return []
+            self.images.invalidate(news_id)
+            return list(self.news_images(session, news_id))
+
+    def collect_media(self):
+        with self.session() as session:
+            return collect_unused_media(session)
+
+    def statistics(self):
+        with self.session() as session:
+            return self.stats.get(session)
+
+    def cache_stats(self):
+        return {'users': self.users.stats(), 'news': self.articles.stats(), 'images': self.images.stats()}
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+# ошибка значит, что записи больше нет (а не что база занята или сервер недоступен)
+def is_not_found(error):
+    return isinstance(error, NoResultFound) or (isinstance(error, ApiError) and error.status == 404)
+
+
+# те же операции через HTTP-сервер; у каждого потока свое keep-alive соединение
+class RemoteNewsService:
+    def __init__(self, base_url, timeout=API_TIMEOUT_SECONDS):
+        url = urlsplit(base_url)
+        self.source = base_url
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.local.connection = connection
+        return connection
+
+    def request(self, method, path, params=None, body=None):
+        if params:
+            path += '?' + urlencode({key: value for key, value in params.items() if value is not None})
+        payload = json.dumps(to_json(body), ensure_ascii=False).encode('utf-8') if body is not None else None
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+
+        # сервер мог закрыть простаивавшее соединение - тогда один раз переподключаемся
+        for attempt in range(2):
+            connection = self.connection()
+            try:
+                connection.request(method, path, body=payload, headers=headers)
+                response = connection.getresponse()
+                data = json.loads(response.read() or b'null')
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                self.local.connection = None
+                if attempt:
+                    raise
+
+        if response.status >= 400:
+            raise ApiError(data.get('error') if isinstance(data, dict) else response.reason, response.status)
+        return data
+
+    def login(self, username, password):
+        return from_json(self.request('POST', '/api/login', body={'username': username, 'password': password}))
+
+    def register(self, username, password, secret_key=''):
+        body = {'username': username, 'password': password, 'secret_key': secret_key}
+        return from_json(self.request('POST', '/api/register', body=body))
+
+    def feed_page(self, category=None, game=None, search_text='', after=None, offset=0, limit=NEWS_PAGE_SIZE,
+                  unread_for=None, sort=None):
+        params = {
+            'category': category, 'game': game, 'search': search_text or None, 'offset': offset, 'limit': limit,
+            'unread_for': unread_for, 'sort': sort,
+        }
+        if after is not None:
+            params['after_date'] = after.date_posted.isoformat()
+            params['after_id'] = after.id
+        return [from_json(row) for row in self.request('GET', '/api/news', params)]
+
+    def facet_counts(self):
+        return [tuple(row) for row in self.request('GET', '/api/facets')]
+
+    def unread_counts(self, user_id):
+        return [tuple(row) for row in self.request('GET', '/api/unread', {'user_id': user_id})]
+
+    def feed_item(self, news_id, unread_for=None):
+        return from_json(self.request('GET', f'/api/news/{news_id}', {'unread_for': unread_for}))
+
+    def news_changes(self, after_id=None):
+        return self.request('GET', '/api/changes', {'after': after_id})
+
+    def news_detail(self, user_id, news_id):
+        news = from_json(self.request('POST', f'/api/news/{news_id}/open', body={'user_id': user_id}))
+        news.images = [from_json(image) for image in news.images]
+        return news
+
+    def add_news(self, user_id, title, content, category, game=None):
+        body = {'user_id': user_id, 'title': title, 'content': content, 'category': category, 'game': game}
+        return self.request('POST', '/api/news', body=body)
+
+    def update_news_content(self, news_id, content):
+        self.request('PUT', f'/api/news/{news_id}', body={'content': content})
+
+    def add_images(self, news_id, paths):
+        return self.request('POST', f'/api/news/{news_id}/images', body={'paths': paths})
+
+    def delete_image(self, image_id):
+        return [from_json(image) for image in self.request('DELETE', f'/api/images/{image_id}')]
+
+    def collect_media(self):
+        return self.request('POST', '/api/media/gc', body={})
+
+    def statistics(self):
+        return self.request('GET', '/api/stats')
+
+
+def create_service():
+    api_url = os.environ.get(API_URL_ENV)
+    if api_url:
+        return RemoteNewsService(api_url)
+    return NewsService(get_engine())
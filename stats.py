@@ -0,0 +1,88 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, select, func, case, true
+
+from models import User, GameNews, NewsImage, NewsView
+
+# за сколько дней показывать разбивку по дням
+STATS_DAYS = 30
+# записи из других процессов событием не ловятся, поэтому кэш еще и устаревает по времени
+STATS_TTL_SECONDS = 60
+
+
+def count_totals(session):
+    users = select(
+        func.count().label('users'),
+        func.coalesce(func.sum(case((User.role == 'Admin', 1), else_=0)), 0).label('admins'),
+        func.coalesce(func.sum(case((User.role == 'Пользователь', 1), else_=0)), 0).label('regular_users'),
+    ).subquery()
+    # просмотры берем из счетчиков game_news, а не COUNT(*) по большой news_views
+    news = select(
+        func.count().label('news'),
+        func.coalesce(func.sum(GameNews.view_count), 0).label('views'),
+    ).subquery()
+    images = select(func.count().label('images')).select_from(NewsImage).subquery()
+
+    # три однострочных подзапроса склеиваются в одну строку
+    totals = users.join(news, true()).join(images, true())
+    row = session.execute(select(users, news, images).select_from(totals)).one()
+    return dict(row._mapping)
+
+
+def count_daily(session, since):
+    articles_day = func.date(GameNews.date_posted)
+    articles = dict(
+        session.query(articles_day, func.count())
+        .filter(GameNews.date_posted >= since)
+        .group_by(articles_day)
+    )
+    views_day = func.date(NewsView.view_date)
+    views = dict(
+        session.query(views_day, func.count())
+        .filter(NewsView.view_date >= since)
+        .group_by(views_day)
+    )
+    days = sorted(set(articles) | set(views), reverse=True)
+    return [(day, articles.get(day, 0), views.get(day, 0)) for day in days]
+
+
+def count_by_game(session):
+    rows = (
+        session.query(GameNews.game, func.count(), func.coalesce(func.sum(GameNews.view_count), 0))
+        .group_by(GameNews.game)
+        .order_by(func.count().desc())
+    )
+    return [(game, articles, views) for game, articles, views in rows]
+
+
+# статистика для окна администратора: считается редко, отдается из кэша; свой кэш на каждую базу
+class StatsService:
+    def __init__(self, engine, ttl=STATS_TTL_SECONDS, days=STATS_DAYS):
+        self.ttl = ttl
+        self.days = days
+        self.lock = threading.Lock()
+        self.cached = None
+        self.cached_at = 0.0
+        # любой коммит в эту базу из этого процесса сбрасывает кэш
+        event.listen(engine, 'commit', self.invalidate)
+
+    def invalidate(self, *args):
+        with self.lock:
+            self.cached = None
+
+    def get(self, session):
+        with self.lock:
+            if self.cached is not None and time.monotonic() - self.cached_at < self.ttl:
+                return self.cached
+
+        since = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=self.days - 1)
+        stats = count_totals(session)
+        stats['daily'] = count_daily(session, since)
+        stats['games'] = count_by_game(session)
+
+        with self.lock:
+            self.cached = stats
+            self.cached_at = time.monotonic()
+        return stats
@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text, update
+
+from bulk_io import BulkImporter
+from models import Base, GameNews, BulkImport, init_db, get_session, search_news
+
+CATEGORIES = ["Обновления", "Релизы"]
+GAMES = [None, "CS2"]
+
+
+def records(count, first_id=1):
+    yield {'type': 'user', 'username': 'admin', 'password': 'admin', 'role': 'Admin'}
+    for number in range(first_id, first_id + count):
+        yield {
+            'type': 'news', 'id': number, 'title': f"патч {number}", 'content': "баланс героев " * 20,
+            'category': CATEGORIES[number % 2], 'game': GAMES[number % 3 % 2], 'author': 'admin',
+        }
+        yield {'type': 'view', 'news_id': number, 'user': 'admin'}
+
+
+def object_names(conn, kind):
+    return set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = :kind"), {'kind': kind}).scalars())
+
+
+def assert_consistent(engine):
+    with engine.connect() as conn:
+        # FTS с внешним содержимым сверяется с game_news самим SQLite
+        conn.execute(text("INSERT INTO game_news_fts(game_news_fts, rank) VALUES ('integrity-check', 1)"))
+        news = conn.execute(text("SELECT count(*) FROM game_news")).scalar()
+        found = conn.execute(text("SELECT count(*) FROM game_news_fts WHERE game_news_fts MATCH 'баланс'")).scalar()
+        assert found == news
+        assert conn.execute(text("SELECT category, game, count FROM news_facets ORDER BY 1, 2")).all() == conn.execute(
+            text("SELECT category, coalesce(game, ''), count(*) FROM game_news GROUP BY 1, 2 ORDER BY 1, 2")
+        ).all()
+        assert conn.execute(text("SELECT sum(count) FROM news_read_facets")).scalar() == conn.execute(
+            text("SELECT count(*) FROM news_views")
+        ).scalar()
+        assert conn.execute(text("SELECT count(*) FROM bulk_imports")).scalar() == 0
+        assert {'game_news_fts_insert', 'news_facets_insert', 'news_changes_insert'} <= object_names(conn, 'trigger')
+        model_indexes = {index.name for model_table in Base.metadata.sorted_tables for index in model_table.indexes}
+        assert model_indexes <= object_names(conn, 'index')
+
+    # триггеры на месте: новая новость сразу находится и попадает в счетчики
+    session = get_session(engine)
+    try:
+        session.add(GameNews(title="свежий патч", content="неожиданный турнир", category="Релизы"))
+        session.commit()
+        assert [row.title for row in search_news(session, 'турнир')] == ["свежий патч"]
+        assert session.execute(
+            text("SELECT count FROM news_facets WHERE category = 'Релизы' AND game = ''")
+        ).scalar() == session.query(GameNews).filter_by(category="Релизы", game=None).count()
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    return f"sqlite:///{tmp_path / 'import.db'}"
+
+
+def test_completed_import_is_consistent(db_url):
+    engine = init_db(db_url)
+    BulkImporter(engine, batch_size=50, progress=None).run_records(records(200))
+    assert_consistent(engine)
+    engine.dispose()
+
+
+def test_interrupted_import_is_finished_on_start(db_url):
+    engine = init_db(db_url)
+    BulkImporter(engine, batch_size=50, progress=None).run_records(records(20))
+
+    # процесс убит посреди загрузки: пачки закоммичены, finish_bulk_import не вызывался
+    importer = BulkImporter(engine, batch_size=50, progress=None)
+    for number, record in enumerate(records(200, first_id=21)):
+        importer.buffers[record['type']].append(record)
+        importer.pending += 1
+        if number == 150:
+            importer.flush()
+    importer.flush()
+    with engine.begin() as conn:
+        assert 'game_news_fts_insert' not in object_names(conn, 'trigger')
+        conn.execute(update(BulkImport).values(updated_at=datetime.utcnow() - timedelta(minutes=5)))
+    engine.dispose()
+
+    engine = init_db(db_url)
+    assert_consistent(engine)
+    engine.dispose()
+
+
+def test_fresh_import_marker_is_left_to_its_importer(db_url):
+    engine = init_db(db_url)
+    importer = BulkImporter(engine, batch_size=50, progress=None)
+    for record in records(30):
+        importer.buffers[record['type']].append(record)
+        importer.pending += 1
+    importer.flush()
+
+    # загрузка еще идет в другом процессе: запуск приложения ее не трогает, она заканчивается сама
+    other = init_db(db_url)
+    with other.connect() as conn:
+        assert 'game_news_fts_insert' not in object_names(conn, 'trigger')
+    other.dispose()
+    importer.run_records(records(10, first_id=31))
+    assert_consistent(engine)
+    engine.dispose()
+
+
+def test_triggers_dropped_without_marker_are_restored(db_url):
+    engine = init_db(db_url)
+    BulkImporter(engine, batch_size=50, progress=None).run_records(records(20))
+    with engine.begin() as conn:
+        conn.execute(text("DROP TRIGGER game_news_fts_insert"))
+        conn.execute(text("DROP INDEX ix_game_news_date"))
+        conn.execute(text(
+            "INSERT INTO game_news(title, content, category, view_count) VALUES ('патч', 'баланс', 'Релизы', 0)"
+        ))
+    engine.dispose()
+
+    engine = init_db(db_url)
+    assert_consistent(engine)
+    engine.dispose()
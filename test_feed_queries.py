@@ -0,0 +1,79 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from models import User, GameNews, NewsView, init_db, get_session, get_news_page, rebuild_view_counts
+from services import NewsService
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = init_db(f"sqlite:///{tmp_path / 'feed.db'}")
+    session = get_session(engine)
+    authors = [User(username=f"author{number}", password="p") for number in range(3)]
+    readers = [User(username=f"reader{number}", password="p") for number in range(20)]
+    session.add_all(authors + readers)
+    session.flush()
+    news = [
+        GameNews(title=f"news {number}", content="text " * 50, category="Релизы", author_id=authors[number % 3].id)
+        for number in range(10)
+    ]
+    session.add_all(news)
+    session.flush()
+    # у первой новости один просмотр, у второй - по просмотру от каждого читателя
+    session.add(NewsView(user_id=readers[0].id, news_id=news[0].id))
+    session.add_all(NewsView(user_id=reader.id, news_id=news[1].id) for reader in readers)
+    session.commit()
+    with engine.begin() as conn:
+        rebuild_view_counts(conn)
+    session.close()
+    yield engine
+    engine.dispose()
+
+
+@contextmanager
+def count_statements(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_feed_page_is_one_statement(engine):
+    session = get_session(engine)
+    try:
+        with count_statements(engine) as statements:
+            rows = get_news_page(session)
+        assert len(rows) == 10
+        assert {row.author_name for row in rows} == {"author0", "author1", "author2"}
+        assert len(statements) == 1
+    finally:
+        session.close()
+
+
+def detail_statements(engine, title):
+    session = get_session(engine)
+    news_id = session.query(GameNews.id).filter_by(title=title).scalar()
+    reader_id = session.query(User.id).filter_by(username="author0").scalar()
+    session.close()
+
+    # новый сервис: кэши пустые, считается холодный путь
+    service = NewsService(engine)
+    with count_statements(engine) as statements:
+        detail = service.news_detail(reader_id, news_id)
+    return detail, len(statements)
+
+
+def test_detail_query_count_does_not_depend_on_views(engine):
+    few, few_statements = detail_statements(engine, "news 0")
+    many, many_statements = detail_statements(engine, "news 1")
+    assert few.views_count == 2
+    assert many.views_count == 21
+    assert few_statements == many_statements
@@ -0,0 +1,59 @@
+BASE_FONT = "Arial"
+BASE_FONT_SIZE = 14
+BACKGROUND_COLOR = "#f0f0f0"
+ACCENT_COLOR = "#3a7bd5"
+
+# одна таблица стилей на все приложение: Qt разбирает ее один раз при запуске,
+# а не на каждом виджете при создании окна. Виджеты выбираются свойствами:
+# appWindow - окна приложения, kind - что сделал StyledWidget.create_*
+APP_STYLESHEET = f'''
+    *[appWindow="true"], *[appWindow="true"] * {{
+        background-color: {BACKGROUND_COLOR};
+    }}
+    QLabel[kind="text"], QLabel[kind="bold"] {{
+        font-family: '{BASE_FONT}';
+        font-size: {BASE_FONT_SIZE}px;
+        color: #333;
+        margin: 5px 0;
+    }}
+    QLabel[kind="bold"] {{
+        font-weight: bold;
+    }}
+    QLineEdit[kind="input"] {{
+        font-family: {BASE_FONT};
+        font-size: {BASE_FONT_SIZE}px;
+        padding: 5px;
+        margin: 5px 0;
+    }}
+    QPushButton[kind="button"] {{
+        background-color: {ACCENT_COLOR};
+        color: white;
+        font-family: {BASE_FONT};
+        font-size: {BASE_FONT_SIZE}px;
+        font-weight: bold;
+        border-radius: 5px;
+        padding: 8px 12px;
+        margin: 5px;
+    }}
+    QPushButton[kind="button"]:hover {{
+        background-color: #3572c4;
+    }}
+    QPushButton[kind="button"]:pressed {{
+        background-color: #2f65aa;
+    }}
+    QListView#newsList {{
+        border: none;
+    }}
+    QTextEdit#newsText, QTextEdit#newsText * {{
+        padding: 5px;
+        font-size: {BASE_FONT_SIZE}px;
+    }}
+    QLabel#newsImage {{
+        margin: 10px;
+    }}
+'''
+
+
+def apply_theme(app):
+    app.setStyleSheet(APP_STYLESHEET)
+
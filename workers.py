@@ -0,0 +1,156 @@
+import os
+from collections import OrderedDict
+
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, QSize, pyqtSignal
+from PyQt5.QtGui import QImageReader, QPixmap
+from profiling import profiler
+
+
+class TaskSignals(QObject):
+    finished = pyqtSignal(object)
+    # в failed уходит само исключение: окно отличает "не найдено" от временных сбоев
+    failed = pyqtSignal(object)
+
+
+# операция сервиса (запрос к базе или к серверу) в фоновом потоке
+class LoaderTask(QRunnable):
+    def __init__(self, fn, args):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+        self.signals = TaskSignals()
+        # задачу держит DataLoader, пул не должен удалять ее до доставки результата
+        self.setAutoDelete(False)
+
+    def run(self):
+        if self.cancelled:
+            return
+
+        try:
+            with profiler.span(getattr(self.fn, '__qualname__', repr(self.fn)), 'worker'):
+                result = self.fn(*self.args)
+        except Exception as error:
+            self.signals.failed.emit(error)
+            return
+
+        self.signals.finished.emit(result)
+
+
+# выполняет запросы вне GUI-потока; по одному ключу живет только последний запрос
+class DataLoader(QObject):
+    def __init__(self, max_threads=4, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.current_tasks = {}
+
+    # fn(*args) выполняется в потоке, результат приходит в on_result уже в GUI-потоке
+    def submit(self, key, fn, *args, on_result=None, on_error=None):
+        self.cancel(key)
+
+        task = LoaderTask(fn, args)
+        self.current_tasks[key] = task
+        task.signals.finished.connect(lambda result: self.deliver(key, task, on_result, result))
+        task.signals.failed.connect(lambda error: self.deliver(key, task, on_error, error))
+        self.pool.start(task)
+        return task
+
+    def is_running(self, key):
+        return key in self.current_tasks
+
+    def cancel(self, key):
+        task = self.current_tasks.pop(key, None)
+        if task is not None:
+            task.cancelled = True
+            self.pool.tryTake(task)
+
+    def deliver(self, key, task, callback, value):
+        # ответ на устаревший запрос (фильтр уже сменили) просто выбрасываем
+        if self.current_tasks.get(key) is not task:
+            return
+        del self.current_tasks[key]
+        if callback:
+            callback(value)
+
+    def wait(self, msecs=-1):
+        return self.pool.waitForDone(msecs)
+
+
+class ImageSignals(QObject):
+    decoded = pyqtSignal(object, object)
+
+
+# декодирует картинку сразу в нужном размере, не поднимая оригинал целиком
+class ImageDecodeTask(QRunnable):
+    def __init__(self, key, target_size):
+        super().__init__()
+        self.key = key
+        self.target_size = target_size
+        self.signals = ImageSignals()
+        self.setAutoDelete(False)
+
+    def run(self):
+        with profiler.span('ImageDecodeTask', 'worker', path=self.key[0]):
+            self.decode()
+
+    def decode(self):
+        path = self.key[0]
+        reader = QImageReader(path)
+        reader.setAutoTransform(True)
+        size = reader.size()
+        if size.isValid():
+            reader.setScaledSize(size.scaled(self.target_size, Qt.KeepAspectRatio))
+        image = reader.read()
+        if not image.isNull() and not size.isValid():
+            image = image.scaled(self.target_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self.signals.decoded.emit(self.key, image)
+
+
+# картинки для карусели: декодирование в фоне и LRU-кэш готовых QPixmap по (путь, mtime)
+class ImageLoader(QObject):
+    image_loaded = pyqtSignal(str, QPixmap)
+
+    def __init__(self, target_size=QSize(300, 300), cache_size=32, max_threads=2, parent=None):
+        super().__init__(parent)
+        self.target_size = target_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+
+    def cache_key(self, path):
+        try:
+            return path, os.path.getmtime(path)
+        except OSError:
+            return None
+
+    # готовая картинка из кэша или None; файл поменялся на диске - будет другой ключ
+    def get(self, path):
+        key = self.cache_key(path)
+        if key is None or key not in self.cache:
+            return None
+        self.cache.move_to_end(key)
+        return self.cache[key]
+
+    def load(self, path):
+        key = self.cache_key(path)
+        if key is None or key in self.cache or key in self.pending:
+            return
+
+        task = ImageDecodeTask(key, self.target_size)
+        self.pending[key] = task
+        task.signals.decoded.connect(self.on_decoded)
+        self.pool.start(task)
+
+    def on_decoded(self, key, image):
+        self.pending.pop(key, None)
+        # QPixmap можно создавать только в GUI-потоке
+        pixmap = QPixmap.fromImage(image)
+        if not pixmap.isNull():
+            self.cache[key] = pixmap
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        self.image_loaded.emit(key[0], pixmap)